@@ -1,15 +1,32 @@
 #!/usr/bin/env python3
 
 import re
+import json
 import subprocess
 import argparse
 import sys
+import time
+import wave
+import mmap
+import struct
+import io
+import sqlite3
+import unicodedata
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import accumulate, chain, repeat
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from collections import OrderedDict, deque
+from queue import Empty, Queue
+from threading import Event, Lock, Thread, local
+from contextlib import contextmanager
+from copy import deepcopy
 from dumbquotes import dumbquote
 from fuzzysearch import find_near_matches as fuzzysearch
 from phonemizer.backend import EspeakBackend
 import os
 
-from typing import Optional, TypeVar
+from typing import Callable, Optional, TypeVar
 from pathlib import Path
 from shutil import (
     unpack_archive,
@@ -53,7 +70,21 @@ vosk_url = "https://alphacephei.com/vosk/models"
 vosk_link = f"[link={vosk_url}]this link[/link]"
 # Default to ffmpeg in PATH
 ffmpeg = 'ffmpeg'
+# vosk models all expect 16KHz mono audio
+sample_rate = 16000
+# Word timing file layout, see write_words()
+words_magic = b'ABWT'
+words_version = 1
+words_header = struct.Struct('<4sIII')
+# Edit distances write_text() allows in turn, as a fraction (1/n) of the chunk length. 0 is exact
+match_levels = (0, 16, 8, 4)
 con = Console()
+# Options that are sent along with a job queued with --spool, see submit_job(). The others belong
+# to the worker, and are given to --serve
+job_options = ('export_srt', 'vad', 'pcm_cache', 'wav', 'grammar', 'stream', 'repair', 'two_pass',
+               'align', 'speculate', 'log_rejected')
+# How often a --serve worker touches its files in the spool directory, to show it's still alive
+heartbeat_seconds = 10
 
 '''
     Utility Function Declarations
@@ -189,7 +220,8 @@ def parse_args():
     """
     Parses command line arguments.
 
-    :return: A tuple containing the audiobook path, metadata file path, and user-defined metadata values
+    :return: A tuple containing the audiobook, text, words, srt and csv paths, the stage to stop after, the
+             language, model name and model type, and a dictionary of tuning options
     """
 
     model_name = ''
@@ -199,15 +231,16 @@ def parse_args():
         description='''
         Splits a single monolithic mp3 audiobook file into multiple files for use in machine learning.
         Works in three steps:
-        1. Uses vosk to generate an SRT file, which has timestamps for every word in the file.
-        2. Uses fuzzy matching to merge the text ebook file with SRT file, generating a csv file
+        1. Uses vosk to generate a word timing file, which has timestamps for every word in the file.
+           (--export-srt also writes it out as an SRT file, for reading.)
+        2. Uses fuzzy matching to merge the text ebook file with the word timings, generating a csv file
            with the results. This can be reviewed for accuracy and hand edited to improve results.
         3. Splits the mp3 audiobook file into pieces based on the csv file. Stores text->audio
            metadata in metadata-all.csv. Appends to the end, if it already exists.
 
         Only works on mp3 files. Audio data is copied, not re-encoded. Text merging is done phonetically.
         ebook text is assumed to be found as "mp3filename.txt"
-        csv and srt files (the intermediate storage between steps) are also named after the mp3 file.
+        words and csv files (the intermediate storage between steps) are also named after the mp3 file.
         output mp3 files are numbered, and the metadata-all.csv file has the corresponding ebook text.
         '''
     )
@@ -216,15 +249,20 @@ def parse_args():
     parser.add_argument('--textfile', '-tf', nargs='?', metavar='TEXTFILE_PATH',
                         type=path_exists, dest='textfile',
                         help='path to text file. Only needed to force a different name')
+    parser.add_argument('--wordsfile', '-wf', nargs='?', metavar='WORDS_PATH',
+                        type=Path, dest='wordsfile',
+                        help='path to generated word timing file (if ran previously in a different directory)')
     parser.add_argument('--srtfile', '-sf', nargs='?', metavar='TIMECODES_PATH',
                         type=Path, dest='srtfile',
                         help='path to generated srt timecode file (if ran previously in a different directory)')
+    parser.add_argument('--export-srt', '-es', action='store_true', dest='export_srt',
+                        help='also write the recognized words out as an srt file, for reading by humans')
     parser.add_argument('--csvfile', '-cf', nargs='?', metavar='CSVCODES_PATH',
                         type=Path, dest='csvfile',
                         help='path to generated csv slicing file (if ran previously in aV different directory)')
     parser.add_argument('--stop-after', '-s', nargs=1, metavar='srt|csv|split',
                         type=str, dest='stop',
-                        help='if set, stop after creating that file.')
+                        help='if set, stop after creating that file. srt means after recognition.')
     parser.add_argument('--language', '-l', dest='lang', nargs='?', default='en-us',
                         metavar='LANGUAGE', type=verify_language,
                         help='model language to use (en-us provided). See the --download_model parameter.')
@@ -235,6 +273,59 @@ def parse_args():
     parser.add_argument('--download_model', '-dm', choices=['small', 'large'], dest='download',
                         nargs='?', default=argparse.SUPPRESS,
                         help='download the model archive specified in the --language parameter')
+    recognizers = parser.add_mutually_exclusive_group()
+    recognizers.add_argument('--jobs', '-j', dest='jobs', type=int, default=1, metavar='N',
+                             help='split the audio at long silences and run N recognizers in parallel. Default is 1.')
+    recognizers.add_argument('--threads', '-t', dest='threads', type=int, default=1, metavar='N',
+                             help='like --jobs, but N threads share a single loaded model. Uses less memory.')
+    parser.add_argument('--vad', action='store_true', dest='vad',
+                        help='skip long silences instead of feeding them to the recognizer. Requires numpy.')
+    parser.add_argument('--two-pass', '-2p', nargs='?', const=0.6, type=float, metavar='THRESHOLD', dest='two_pass',
+                        help='recognize words with less than THRESHOLD (default 0.6) confidence over again with the '
+                             'large model. Use with the (default) small model.')
+    parser.add_argument('--repair', nargs='?', const='large', choices=['small', 'large'], dest='repair',
+                        help='after merging, recognize the audio around text that didn\'t match over again (with the large '
+                             'model, by default) and merge just that again')
+    parser.add_argument('--align', '-a', choices=['greedy', 'anchors', 'global', 'chapters'], default='greedy', dest='align',
+                        help='how to match the ebook with the recognized text. greedy matches each bit in turn. anchors '
+                             'pins down the ebook first at unmistakable phrases, and matches what is between them, '
+                             '--jobs at once. global aligns the whole book in one go (requires numpy). '
+                             'chapters finds the chapter headings, and merges the chapters --jobs at once. '
+                             'Default is greedy.')
+    parser.add_argument('--speculate', nargs='?', const=8, default=0, type=int, metavar='K', dest='speculate',
+                        help='while merging the greedy way, once a bit of the ebook isn\'t found, search for the '
+                             'next K (default 8) ahead of time, --jobs at once. Only faster with cores to spare')
+    parser.add_argument('--log-rejected', action='store_true', dest='log_rejected',
+                        help='also log the matches that weren\'t good enough in the csv file, as M records')
+    parser.add_argument('--stream', action='store_true', dest='stream',
+                        help='merge words with the ebook while the rest of the audio is still being recognized')
+    parser.add_argument('--grammar', '-g', action='store_true', dest='grammar',
+                        help='only let the recognizer hear words that are in the ebook. Small models only.')
+    parser.add_argument('--pcm-cache', '-pc', nargs='?', const=True, default=None, metavar='CACHE_DIR',
+                        dest='pcm_cache',
+                        help='decode the audio once, and keep it next to the audiobook (or in CACHE_DIR)\n'
+                             'for recognition and silence detection to read from.')
+    parser.add_argument('--wav', action='store_true', dest='wav',
+                        help='write the split files as 16KHz mono .wav files, from the decoded audio, instead of '
+                             'copying them out of the mp3')
+    phoneme_cache = parser.add_mutually_exclusive_group()
+    phoneme_cache.add_argument('--phoneme-cache', '-phc', default=Path('model/phonemes.sqlite'), type=Path,
+                               metavar='CACHE_FILE', dest='phoneme_cache',
+                               help='keep the phonemes of every word and sentence merged in CACHE_FILE, for all '
+                                    'books and runs to share. Default is model/phonemes.sqlite')
+    phoneme_cache.add_argument('--no-phoneme-cache', action='store_const', const=None, dest='phoneme_cache',
+                               help="don't use (or create) a phoneme cache")
+    parser.add_argument('--build-lexicon', dest='build_lexicon', type=path_exists, metavar='LIBRARY_DIR',
+                        help='phonemize every word of the books (.txt, .srt and .words files) in LIBRARY_DIR, '
+                             'and every sentence of the ebooks, into the phoneme cache, and exit. Uses --jobs espeak '
+                             'instances.')
+    workers = parser.add_mutually_exclusive_group()
+    workers.add_argument('--serve', dest='serve', type=Path, metavar='SPOOL_DIR',
+                         help='run as a worker, keeping models loaded, and process jobs queued in SPOOL_DIR')
+    workers.add_argument('--spool', dest='spool', type=Path, metavar='SPOOL_DIR',
+                         help='queue the audiobook for a --serve worker watching SPOOL_DIR and wait for it')
+    parser.add_argument('--timeout', default=60, type=int, metavar='SECONDS', dest='timeout',
+                        help='with --spool, give up once no worker has been heard from for SECONDS. Default is 60')
 
     args = parser.parse_args()
     config = parse_config()
@@ -308,21 +399,70 @@ def parse_args():
         con.print("[bold red]CRITICAL:[/] ffmpeg was not found in config file or system PATH. Aborting")
         sys.exit(1)
 
+    if args.stop:
+        stop=args.stop[0]
+    else:
+        stop=None
+    if args.jobs < 1 or args.threads < 1:
+        con.print("[bold red]ERROR:[/] --jobs and --threads must be at least 1")
+        sys.exit(1)
+    if args.stream and args.two_pass is not None:
+        con.print("[bold red]ERROR:[/] --stream can't be used with --two-pass, which changes words after the fact")
+        sys.exit(1)
+    if args.spool and (args.jobs != 1 or args.threads != 1 or args.phoneme_cache != Path('model/phonemes.sqlite')):
+        con.print("[bold red]ERROR:[/] --jobs, --threads and the phoneme cache belong to the worker. "
+                  "Give them to --serve instead of --spool")
+        sys.exit(1)
+    if args.timeout <= 2 * heartbeat_seconds:
+        con.print(f"[bold red]ERROR:[/] --timeout must be more than {2 * heartbeat_seconds} seconds, "
+                  f"workers are only heard from every {heartbeat_seconds}")
+        sys.exit(1)
+    if args.speculate and (args.stream or args.align != 'greedy'):
+        con.print("[bold red]ERROR:[/] --speculate only works with the greedy merge, without --stream")
+        sys.exit(1)
+
+    options = {
+        'jobs': args.jobs,
+        'threads': args.threads,
+        'serve': args.serve,
+        'spool': args.spool,
+        'timeout': args.timeout,
+        'export_srt': args.export_srt,
+        'vad': args.vad,
+        'pcm_cache': args.pcm_cache,
+        'wav': args.wav,
+        'grammar': args.grammar,
+        'stream': args.stream,
+        'repair': args.repair,
+        'two_pass': args.two_pass,
+        'phoneme_cache': args.phoneme_cache,
+        'build_lexicon': args.build_lexicon,
+        'align': args.align,
+        'speculate': args.speculate,
+        'log_rejected': args.log_rejected
+    }
+
+    # A worker takes its audiobooks from the spool directory instead, and a lexicon is for a whole library
+    if args.serve or args.build_lexicon:
+        return None, None, None, None, None, stop, language, model_name, model_type, options
+    if not args.audiobook:
+        con.print("[bold red]CRITICAL:[/] No audiobook file was given. Aborting")
+        sys.exit(1)
+
     if not args.textfile:
         args.textfile = args.audiobook.with_suffix('.txt')
         if not args.textfile.exists():
             # When textfile is specified on the command line, argsparser makes sure it exists.
             con.print(f"[bold red]CRITICAL:[/] Text file {args.textfile} was not found. Aborting")
+    if not args.wordsfile:
+        args.wordsfile = args.audiobook.with_suffix('.words')
     if not args.srtfile:
         args.srtfile = args.audiobook.with_suffix('.srt')
     if not args.csvfile:
         args.csvfile = args.audiobook.with_suffix('.csv')
-    if args.stop:
-        stop=args.stop[0]
-    else:
-        stop=None
 
-    return args.audiobook, args.textfile, args.srtfile, args.csvfile, stop, language, model_name, model_type
+    return (args.audiobook, args.textfile, args.wordsfile, args.srtfile, args.csvfile,
+            stop, language, model_name, model_type, options)
 
 
 def build_progress(bar_type: str) -> Progress:
@@ -494,12 +634,17 @@ def download_model(name: str) -> None:
 
 
 def split_file(audiobook_path: PathLike,
-               timecodes: list[dict]) -> int:
+               timecodes: list[dict],
+               pcm_cache: Optional['PcmCache'] = None) -> int:
 
     """Splits a single .mp3 file into chapterized segments.
 
+    Segments are copied out of the mp3 with ffmpeg. Only if pcm_cache is given (--wav), they are
+    written as 16KHz mono .wav files straight from the decoded audio instead.
+
     :param audiobook_path: Path to original .mp3 audiobook
     :param timecodes: List of start/end markers for each chapter
+    :param pcm_cache: PcmCache of the audiobook, to write .wav files from
     :return: An integer status code
     """
 
@@ -535,6 +680,18 @@ def split_file(audiobook_path: PathLike,
     with progress:
         task = progress.add_task('', total=len(timecodes), verb='Splitting', noun='Audiobook...')
         for counter, times in enumerate(timecodes, start=1):
+            if pcm_cache:
+                with wave.open(str(audiobook_path.parent.joinpath(f"{counter+counter_offset}.wav")), 'wb') as clip:
+                    clip.setnchannels(1)
+                    clip.setsampwidth(2)
+                    clip.setframerate(sample_rate)
+                    samples = pcm_cache.slice(times.get('start', 0), times.get('end'))
+                    clip.writeframes(samples)
+                    samples.release()
+                metadata.write(f"{counter+counter_offset}|{times['text']}\n")
+                progress.update(task, advance=1)
+                continue
+
             command_copy = command.copy()
             if 'start' in times:
                 command_copy[5:5] = ['-ss', str(times['start']) + 'ms' ]
@@ -565,28 +722,208 @@ def split_file(audiobook_path: PathLike,
     return counter_offset + len(timecodes)
 
 
-def generate_timecodes(audiobook_path: PathLike, out_file: PathLike, language: str, model_type: str) -> Path:
-    """Generate chapter timecodes using vosk Machine Learning API.
+def get_duration_ms(audiobook_path: PathLike, pcm_cache: Optional['PcmCache'] = None) -> int:
+    """Ask ffprobe for the length of the audiobook.
 
-    This function searches for the specified model/language within the project's 'models' directory and
-    uses it to perform a speech-to-text conversion on the audiobook, which is then saved in a subrip (srt) file.
+    :param audiobook_path: Path to input audiobook file
+    :param pcm_cache: PcmCache of the audiobook. If given, the length is taken from it instead
+    :return: Length of the audio in milliseconds
+    """
+
+    if pcm_cache:
+        return pcm_cache.duration_ms
+
+    length = subprocess.run(["ffprobe", '-show_entries',
+                             'format=duration', '-i', audiobook_path],
+                            text=True, capture_output=True).stdout
+    (_, length, _) = length.splitlines()
+    (_, length) = length.split('=')
+    return int(float(length) * 1000)
+
+
+def find_silences(audiobook_path: PathLike, noise: str = '-35dB', duration: float = 0.5,
+                  pcm_cache: Optional['PcmCache'] = None) -> list[tuple[int, int]]:
+    """Find the silent stretches of an audiobook using ffmpeg's silencedetect filter.
+
+    Decoding is far cheaper than recognition, so this extra pass is a small price for knowing
+    where the audio can be cut without cutting a word in half.
+
+    :param audiobook_path: Path to input audiobook file
+    :param noise: Volume below which audio counts as silence
+    :param duration: Minimum length (in seconds) of a silence
+    :param pcm_cache: PcmCache of the audiobook. If given, it is scanned instead of the mp3
+    :return: List of (start, end) tuples in milliseconds
+    """
+
+    if pcm_cache:
+        pcm_cache.load()
+        source = ['-f', 's16le', '-ar', str(sample_rate), '-ac', '1', '-i', str(pcm_cache.path)]
+    else:
+        source = ['-i', str(audiobook_path)]
+    result = subprocess.run([str(ffmpeg), '-hide_banner', '-nostats', *source,
+                             '-af', f'silencedetect=noise={noise}:d={duration}', '-f', 'null', '-'],
+                            text=True, capture_output=True)
+    silences = []
+    start = None
+    for line in result.stderr.splitlines():
+        if (found := re.search(r'silence_start: (-?[\d.]+)', line)) is not None:
+            start = max(0, int(float(found.group(1)) * 1000))
+        elif (found := re.search(r'silence_end: (-?[\d.]+)', line)) is not None and start is not None:
+            silences.append((start, int(float(found.group(1)) * 1000)))
+            start = None
+
+    return silences
+
+
+def plan_segments(length: int, silences: list[tuple[int, int]], count: int) -> list[tuple[int, int]]:
+    """Split the audio into (roughly) equal segments, cutting in the middle of silences.
+
+    For each ideal cut point, the longest silence within a tenth of a segment length is used. If
+    there is none, the nearest silence is used instead. Cut points which would produce an empty
+    segment are dropped, so fewer than count segments can be returned.
+
+    :param length: Length of the audio in milliseconds
+    :param silences: List of (start, end) silences in milliseconds, see find_silences()
+    :param count: Number of segments wanted
+    :return: List of (start, end) segments in milliseconds, covering the whole audio
+    """
+
+    cuts = [0]
+    if silences:
+        radius = length // count // 10
+        for i in range(1, count):
+            ideal = length * i // count
+            nearby = [s for s in silences if s[0] - radius <= ideal <= s[1] + radius]
+            if nearby:
+                silence = max(nearby, key=lambda s: s[1] - s[0])
+            else:
+                silence = min(silences, key=lambda s: abs((s[0] + s[1]) // 2 - ideal))
+            cut = (silence[0] + silence[1]) // 2
+            if cuts[-1] < cut < length:
+                cuts.append(cut)
+    cuts.append(length)
+
+    return list(zip(cuts[:-1], cuts[1:]))
 
-    If more than 1 model is present, the script will attempt to guess which one to use based on input.
+
+def open_pcm(audiobook_path: PathLike, start: int = 0, end: Optional[int] = None) -> subprocess.Popen:
+    """Start ffmpeg decoding (part of) the audiobook to the raw format vosk expects.
 
     :param audiobook_path: Path to input audiobook file
+    :param start: Offset in milliseconds to start decoding at
+    :param end: Offset in milliseconds to stop decoding at, or None for the end of the file
+    :return: The ffmpeg process. Raw 16 bit little endian mono samples can be read from its stdout
+    """
+
+    command = [str(ffmpeg), "-loglevel", "quiet"]
+    if start:
+        command += ['-ss', f'{start}ms']
+    command += ['-i', str(audiobook_path)]
+    if end is not None:
+        command += ['-t', f'{end - start}ms']
+    command += ["-ar", str(sample_rate), "-ac", "1", "-f", "s16le", "-"]
+
+    return subprocess.Popen(command, stdout=subprocess.PIPE)
+
+
+class PcmReader:
+    """File-like reader over a slice of a PcmCache, so it can stand in for ffmpeg's stdout."""
+
+    def __init__(self, view: memoryview):
+        self.view = view
+        self.position = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def read(self, size: int = -1) -> bytes:
+        end = len(self.view) if size < 0 else self.position + size
+        data = bytes(self.view[self.position:end])
+        self.position += len(data)
+        return data
+
+    def close(self) -> None:
+        self.view.release()
+
+
+class PcmCache:
+    """The audiobook decoded once to raw 16KHz mono samples, and kept on disk.
+
+    Recognition and splitting can then take any slice of the audio straight out of a memory
+    mapped file, instead of running ffmpeg (and seeking through the mp3) every time. The cache is
+    written as <audiobook>.pcm next to the audiobook or in cache_dir, with a small json file
+    recording the size and modification time of the audiobook it was decoded from. If either
+    changes, the cache is decoded again.
+
+    Decoding happens on first use, so a cache that turns out not to be needed costs nothing.
+    Pickling only passes the paths along, so worker processes map the same file.
+    """
+
+    def __init__(self, audiobook_path: PathLike, cache_dir: Optional[PathLike] = None):
+        self.audiobook_path = Path(audiobook_path)
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.path = (self.cache_dir or self.audiobook_path.parent) / f"{self.audiobook_path.stem}.pcm"
+        self.meta = Path(f"{self.path}.json")
+        self.mmap = None
+
+    def __reduce__(self):
+        return PcmCache, (self.audiobook_path, self.cache_dir)
+
+    def _source(self) -> dict:
+        stat = self.audiobook_path.stat()
+        return {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sample_rate': sample_rate}
+
+    def load(self) -> mmap.mmap:
+        """Decode the audio if the cache is missing or stale, and map it"""
+        if self.mmap is not None:
+            return self.mmap
+
+        if not (self.path.exists() and self.meta.exists() and json.loads(self.meta.read_text()) == self._source()):
+            con.print(f"[magenta]Decoding audio to {self.path.name}...[/magenta]")
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            temp = Path(f"{self.path}.tmp")
+            with open(temp, 'wb') as fp:
+                subprocess.run([str(ffmpeg), "-loglevel", "quiet", "-i", str(self.audiobook_path),
+                                "-ar", str(sample_rate), "-ac", "1", "-f", "s16le", "-"], stdout=fp, check=True)
+            os.replace(temp, self.path)
+            self.meta.write_text(json.dumps(self._source()))
+
+        with open(self.path, 'rb') as fp:
+            self.mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.mmap
+
+    @property
+    def duration_ms(self) -> int:
+        """Length of the audio in milliseconds"""
+        return len(self.load()) * 1000 // (sample_rate * 2)
+
+    def slice(self, start: int = 0, end: Optional[int] = None) -> memoryview:
+        """Zero copy view of the samples between start and end (in ms)"""
+        data = memoryview(self.load())
+        first = start * sample_rate // 1000 * 2
+        last = len(data) if end is None else end * sample_rate // 1000 * 2
+        return data[first:last]
+
+    def open(self, start: int = 0, end: Optional[int] = None) -> PcmReader:
+        """File-like reader of the samples between start and end (in ms), like open_pcm()"""
+        return PcmReader(self.slice(start, end))
+
+
+def find_model(language: str, model_type: str) -> Optional[Path]:
+    """Find the local model directory for the language and model type.
+
+    If more than 1 model is present, attempts to guess which one to use based on model_type.
+
     :param language: Language used by the parser
     :param model_type: The type of model (large or small)
-    :return: Path to timecode file
+    :return: Path to the model directory, or None if it couldn't be found
     """
 
-    sample_rate = 16000
     model_root = Path(r"model")
-
-    # If the timecode file already exists, exit early and return path
-    if out_file.exists() and out_file.stat().st_size > 10:
-        con.print("[bold green]SUCCESS![/] An existing srt timecode file was found")
-
-        return out_file
+    model_path = None
 
     try:
         if model_path := [d for d in model_root.iterdir() if d.is_dir() and language in d.stem]:
@@ -603,6 +940,8 @@ def generate_timecodes(audiobook_path: PathLike, out_file: PathLike, language: s
                     model_path = [d for d in model_path if 'small' not in d.stem][0]
             else:
                 model_path = model_path[0]
+        else:
+            raise IndexError
     except IndexError:
         con.print(
             "[bold yellow]WARNING:[/] Local ML model was not found (did you delete it?) "
@@ -612,30 +951,875 @@ def generate_timecodes(audiobook_path: PathLike, out_file: PathLike, language: s
         )
         model_path = None
 
+    return model_path
+
+
+def load_model(model_path: Optional[Path], language: str) -> Model:
+    """Load a vosk model, quietly.
+
+    :param model_path: Path to the model directory, or None to let vosk download one
+    :param language: Language of the model
+    :return: The loaded vosk Model
+    """
+
     SetLogLevel(-1)
-    model = Model(lang=language, model_path=str(model_path))
-    rec = KaldiRecognizer(model, sample_rate)
+    return Model(lang=language, model_path=str(model_path) if model_path else None)
+
+
+def supports_grammar(model_path: Optional[Path]) -> bool:
+    """Check if a model can be restricted to a vocabulary at runtime.
+
+    Only models with a separate (lookahead) language model graph can. The big models have a
+    single precompiled HCLG.fst instead, and ignore any grammar they are given.
+    """
+    return model_path is not None and (Path(model_path) / 'graph' / 'HCLr.fst').exists()
+
+
+def book_words(text: str) -> set[str]:
+    """Find the words a recognizer would hear when the text is read out.
+
+    That is every word, in lower case and without punctuation. Numbers are read out as words,
+    so if the text has any digits, the number words are added.
+
+    :param text: Text of an ebook, or part of one
+    :return: Set of words
+    """
+
+    text = dumbquote(text).lower()
+    words = set(re.findall(r"[^\W\d_]+(?:'[^\W\d_]+)*", text))
+    if re.search(r'\d', text):
+        words.update((
+            'zero', 'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine', 'ten',
+            'eleven', 'twelve', 'thirteen', 'fourteen', 'fifteen', 'sixteen', 'seventeen', 'eighteen',
+            'nineteen', 'twenty', 'thirty', 'forty', 'fifty', 'sixty', 'seventy', 'eighty', 'ninety',
+            'hundred', 'thousand', 'million', 'first', 'second', 'third', 'oh'
+        ))
+
+    return words
+
+
+def build_grammar(text: str) -> str:
+    """Build a recognizer vocabulary out of the words of the ebook.
+
+    We know exactly what the narrator is reading, so there is no point in letting vosk consider
+    the hundreds of thousands of other words in the model. A smaller vocabulary decodes faster,
+    and has far fewer near misses for the merge to sort out.
+
+    "[unk]" lets the recognizer say it heard something else (credits, music, and so on) instead of
+    forcing it onto a book word.
+
+    :param text: Text of the ebook, or of the part of it that is to be recognized
+    :return: Json list of words, as accepted by KaldiRecognizer
+    """
+
+    return json.dumps(sorted(book_words(text)) + ['[unk]'])
+
+
+def seconds_to_ms(seconds: float) -> int:
+    """Convert a vosk timestamp to milliseconds.
+
+    Rounds to microseconds first and then truncates, which is what the srt module (and therefore
+    KaldiRecognizer.SrtResult) did with the same value.
+    """
+    return int(round(seconds * 1000000)) // 1000
+
+
+def result_words(result: str, offset: int = 0, time_map: Optional[Callable[[int], int]] = None) -> list[dict]:
+    """Convert a vosk json result into a list of words.
+
+    :param result: Json string returned by KaldiRecognizer.Result() or FinalResult()
+    :param offset: Milliseconds to add to every timestamp
+    :param time_map: Function converting the recognizer's timestamps (in ms) before the offset is added
+    :return: List of dictionaries with start, end (both in ms), conf and word
+    """
+
+    time_map = time_map or (lambda ms: ms)
+    return [
+        {
+            'start': time_map(seconds_to_ms(word['start'])) + offset,
+            'end': time_map(seconds_to_ms(word['end'])) + offset,
+            'conf': word.get('conf', 1.0),
+            'word': word['word']
+        }
+        for word in json.loads(result).get('result', [])
+    ]
+
+
+class Checkpoint:
+    """Append only journal of the words recognized in one segment of audio.
+
+    Every time vosk finalizes an utterance its words are appended, together with the position in
+    the audio that was reached, and flushed to disk. If recognition dies, the next run reads the
+    journal back and continues from that position instead of starting over. A line that was only
+    half written when the process died is dropped (and cut off the file).
+    """
+
+    def __init__(self, path: Path, start: int):
+        self.path = path
+        self.position = start
+        self.words = []
+        self.done = False
+        self.fp = None
+
+        if path.exists():
+            data = path.read_bytes()
+            good = 0
+            for line in data.splitlines(keepends=True):
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                if not line.endswith(b'\n'):
+                    break
+                good += len(line)
+                self.words += entry['words']
+                self.position = entry['position']
+                self.done = entry['done']
+            if good != len(data):
+                with open(path, 'r+b') as fp:
+                    fp.truncate(good)
+
+    def commit(self, words: list[dict], position: int, done: bool = False) -> None:
+        """Durably record words, and the position (in ms) up to which the audio has been recognized."""
+        if self.fp is None:
+            self.fp = open(self.path, 'a')
+        self.fp.write(json.dumps({'position': position, 'done': done, 'words': words}) + '\n')
+        self.fp.flush()
+        os.fsync(self.fp.fileno())
+        self.words += words
+        self.position = position
+        self.done = done
+
+    def close(self) -> None:
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+
+
+class VoiceActivityFilter:
+    """Drops long stretches of silence from a raw audio stream before it reaches the recognizer.
+
+    Audiobooks have plenty of audio with nothing to recognize: padding before and after the book,
+    pauses between chapters, and so on. The recognizer costs the same for all of it. This wraps the
+    decoded stream, measures the energy of every 30ms frame with numpy, and leaves out any frame
+    further than padding_ms from a frame louder than the threshold. Short pauses are kept whole,
+    long ones are cut down to padding_ms on each side, so vosk still sees the end of a sentence.
+
+    Since the recognizer sees less audio than there is, its timestamps are off. to_source_ms()
+    maps them back, using the list of runs of audio that were kept.
+    """
+
+    frame = sample_rate * 30 // 1000
+
+    def __init__(self, stream, threshold: float = -50.0, padding_ms: int = 300, block_ms: int = 10000):
+        try:
+            import numpy
+        except ImportError:
+            con.print(
+                "[bold red]CRITICAL:[/] numpy library is not available, and is required for "
+                "--vad. Run [bold green]pip install numpy[/] and re-run the script."
+            )
+            sys.exit(19)
+
+        self.np = numpy
+        self.stream = stream
+        self.threshold = threshold
+        self.padding = padding_ms * sample_rate // 1000 // self.frame
+        self.block = block_ms * sample_rate // 1000 * 2
+        # Samples read but not yet decided on, and whether the frames before them were speech
+        self.pending = b''
+        self.history = numpy.zeros(self.padding, dtype=bool)
+        self.output = bytearray()
+        self.eof = False
+        # Kept runs of audio as (output sample, source sample), with the total length of each list
+        self.out_starts = []
+        self.src_starts = []
+        self.out_length = 0
+        self.src_length = 0
+
+    def read(self, size: int) -> bytes:
+        """Read up to size bytes of filtered audio. Returns b'' at the end of the stream."""
+        while len(self.output) < size and not self.eof:
+            data = self.stream.read(self.block)
+            if len(data) == 0:
+                self.eof = True
+            self._filter(data)
+        data = bytes(self.output[:size])
+        del self.output[:size]
+        return data
+
+    def _filter(self, data: bytes) -> None:
+        np = self.np
+        data = self.pending + data
+        samples = np.frombuffer(data, dtype='<i2', count=len(data) // 2)
+        frames = len(samples) // self.frame
+        energy = np.square(samples[:frames * self.frame].astype(np.float32)).reshape(frames, self.frame).mean(axis=1)
+        # dB relative to full scale
+        speech = 10 * np.log10(energy + 1e-9) - 90.3 > self.threshold
+
+        # Keep every frame within padding of speech. The last frames depend on audio that hasn't
+        # been read yet, so they are held back for the next block (unless there isn't one)
+        context = np.concatenate((self.history, speech))
+        keep = np.convolve(context, np.ones(2 * self.padding + 1), mode='same')[len(self.history):] > 0
+        decided = frames if self.eof else max(0, frames - self.padding)
+        if decided == 0:
+            self.pending = data
+            return
+        self.history = context[len(self.history) + decided - self.padding:len(self.history) + decided]
+        self.pending = data[decided * self.frame * 2:]
+
+        # Copy out the kept runs, and note where they came from
+        edges = np.flatnonzero(np.diff(np.concatenate(([False], keep[:decided], [False])).astype(np.int8)))
+        for start, end in zip(edges[::2].tolist(), edges[1::2].tolist()):
+            source = self.src_length + start * self.frame
+            if self.out_starts and self.src_starts[-1] + self.out_length - self.out_starts[-1] == source:
+                pass  # Continues the previous run
+            else:
+                self.out_starts.append(self.out_length)
+                self.src_starts.append(source)
+            self.output += data[start * self.frame * 2:end * self.frame * 2]
+            self.out_length += (end - start) * self.frame
+        self.src_length += decided * self.frame
+        if self.eof:
+            # Trailing part of a frame
+            self.output += self.pending
+            if self.pending and self.out_starts:
+                self.out_length += len(self.pending) // 2
+            self.pending = b''
+
+    def to_source_ms(self, ms: int) -> int:
+        """Convert a time in the filtered audio to the same point in the original audio."""
+        sample = ms * sample_rate // 1000
+        run = bisect_right(self.out_starts, sample) - 1
+        if run < 0:
+            return ms
+        return (self.src_starts[run] + sample - self.out_starts[run]) * 1000 // sample_rate
+
+
+def recognize_stream(rec: KaldiRecognizer, stream, offset: int = 0, checkpoint: Optional[Checkpoint] = None,
+                     time_map: Optional[Callable[[int], int]] = None,
+                     on_words: Optional[Callable[[list[dict]], None]] = None) -> list[dict]:
+    """Feed a raw audio stream to a recognizer and collect every recognized word.
+
+    :param rec: KaldiRecognizer with SetWords(True)
+    :param stream: File-like object returning raw 16 bit mono samples
+    :param offset: Milliseconds to add to every timestamp, for streams that don't start at 0
+    :param checkpoint: If given, every finalized result is committed to it
+    :param time_map: Function converting times in the stream to times in the audio it came from,
+                     for streams which had parts cut out (see VoiceActivityFilter)
+    :param on_words: If given, called with the words of every finalized result, as soon as there is one
+    :return: List of words, see result_words()
+    """
+
+    on_words = on_words or (lambda words: None)
+    time_map = time_map or (lambda ms: ms)
+    words = []
+    fed = 0
+    while True:
+        data = stream.read(4000)
+        if len(data) == 0:
+            break
+        fed += len(data)
+        if rec.AcceptWaveform(data):
+            result = result_words(rec.Result(), offset, time_map)
+            if checkpoint:
+                checkpoint.commit(result, offset + time_map(fed * 1000 // (sample_rate * 2)))
+            on_words(result)
+            words += result
+    result = result_words(rec.FinalResult(), offset, time_map)
+    if checkpoint:
+        checkpoint.commit(result, offset + time_map(fed * 1000 // (sample_rate * 2)), done=True)
+    on_words(result)
+    words += result
+
+    return words
+
+
+def recognize_segment(model: Model, audiobook_path: PathLike, start: int, end: int,
+                      checkpoints: Optional[Path] = None, show_progress: bool = False,
+                      vad: bool = False, pcm_cache: Optional[PcmCache] = None,
+                      grammar: Optional[str] = None,
+                      on_words: Optional[Callable[[list[dict]], None]] = None) -> list[dict]:
+    """Recognize a single segment of the audiobook.
+
+    :param model: Loaded vosk Model
+    :param audiobook_path: Path to input audiobook file
+    :param start: Start of the segment in milliseconds
+    :param end: End of the segment in milliseconds
+    :param checkpoints: Directory to keep the segment's Checkpoint in. If it has one from an
+                        earlier run, recognition continues where that run stopped
+    :param show_progress: Show a progress bar while decoding
+    :param vad: Leave long silences out of what the recognizer sees, see VoiceActivityFilter
+    :param pcm_cache: PcmCache to read the audio from, instead of decoding it with ffmpeg
+    :param grammar: Json list of the only words the recognizer may return, see build_grammar()
+    :param on_words: Called with words as they are recognized, see recognize_stream(). Words
+                     recovered from a checkpoint are passed on first
+    :return: List of words with timestamps relative to the start of the audiobook
+    """
+
+    checkpoint = Checkpoint(checkpoints / f'{start}-{end}.jsonl', start) if checkpoints else None
+    if checkpoint and checkpoint.words and on_words:
+        on_words(checkpoint.words)
+    if checkpoint and checkpoint.done:
+        return checkpoint.words
+    if checkpoint and checkpoint.position > start:
+        con.print(f"Resuming recognition of {start}-{end}ms at {checkpoint.position}ms")
+        start = checkpoint.position
+
+    rec = KaldiRecognizer(model, sample_rate, grammar) if grammar else KaldiRecognizer(model, sample_rate)
     rec.SetWords(True)
+    process = None if pcm_cache else open_pcm(audiobook_path, start, end)
+    source = pcm_cache.open(start, end) if pcm_cache else process.stdout
+    try:
+        # Length of the raw audio is 2 bytes per sample, 16K samples per second
+        length = (end - start) * sample_rate * 2 // 1000
+        with (rich.progress.wrap_file(source, length) if show_progress else source) as stream:
+            if vad:
+                stream = VoiceActivityFilter(stream)
+                words = recognize_stream(rec, stream, start, checkpoint, stream.to_source_ms, on_words)
+            else:
+                words = recognize_stream(rec, stream, start, checkpoint, on_words=on_words)
+    finally:
+        source.close()
+        if process:
+            process.wait()
+        if checkpoint:
+            checkpoint.close()
+
+    return checkpoint.words if checkpoint else words
+
+
+# Per process model, loaded once by _init_worker() for every segment the process recognizes
+_worker_model = None
 
+
+def _init_worker(model_path: Optional[Path], language: str, ffmpeg_path: str) -> None:
+    """Process pool initializer. Loads the model once per worker process."""
+    global _worker_model, ffmpeg
+    ffmpeg = ffmpeg_path
+    _worker_model = load_model(model_path, language)
+
+
+def _recognize_worker(audiobook_path: PathLike, start: int, end: int, options: dict) -> list[dict]:
+    """Process pool task. Recognizes one segment with the worker's model."""
+    return recognize_segment(_worker_model, audiobook_path, start, end, **options)
+
+
+class RecognizerPool:
+    """Several KaldiRecognizers sharing one loaded vosk Model.
+
+    Loading a model costs its full size in memory (gigabytes for the large models) and a good
+    while to read in. Every process started with --jobs pays that again. Here the model is loaded
+    once, and each segment gets its own (cheap) KaldiRecognizer on a worker thread. vosk releases
+    the GIL while decoding, so the threads really do run in parallel.
+
+    A pool isn't tied to an audiobook, so a single pool can serve segments of several books.
+    """
+
+    def __init__(self, model_path: Optional[Path], language: str, threads: int):
+        self.threads = threads
+        self.model_path = model_path
+        self.model = load_model(model_path, language)
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def submit(self, audiobook_path: PathLike, start: int, end: int, **options) -> Future:
+        """Queue a segment for recognition. The future's result is the list of words.
+
+        options are passed on to recognize_segment().
+        """
+        return self.executor.submit(recognize_segment, self.model, audiobook_path, start, end, **options)
+
+    def close(self) -> None:
+        """Wait for queued segments to finish and stop the threads."""
+        self.executor.shutdown()
+
+
+def recognize_parallel(audiobook_path: PathLike, model_path: Optional[Path], language: str, jobs: int,
+                       pool: Optional[RecognizerPool] = None, show_progress: bool = True,
+                       on_words: Optional[Callable[[list[dict]], None]] = None, **options) -> list[dict]:
+    """Recognize an audiobook with several recognizers at once.
+
+    The audio is cut into segments at long silences, and each segment is recognized by its own
+    process, or by a thread of pool if one is given. Words are returned in order, with timestamps
+    relative to the start of the audiobook.
+
+    :param audiobook_path: Path to input audiobook file
+    :param model_path: Path to the model directory
+    :param language: Language of the model
+    :param jobs: Number of processes to use. Ignored if pool is given
+    :param pool: RecognizerPool to use instead of starting processes
+    :param show_progress: Show a progress bar of the segments done
+    :param on_words: If given, called with the words of each segment, in order, as soon as it and
+                     every segment before it are done
+    :param options: Passed on to recognize_segment() for every segment. The segment plan is kept
+                    in the checkpoints directory too, if there is one
+    :return: List of words, see result_words()
+    """
+
+    count = pool.threads if pool else jobs
+    pcm_cache = options.get('pcm_cache')
+    plan = options['checkpoints'] / 'plan.json' if options.get('checkpoints') else None
+    if plan and plan.exists() and json.loads(plan.read_text())['count'] == count:
+        segments = [tuple(segment) for segment in json.loads(plan.read_text())['segments']]
+    else:
+        if count > 1:
+            con.print("[magenta]Looking for silences to split the audio at...[/magenta]")
+            silences = find_silences(audiobook_path, pcm_cache=pcm_cache)
+        else:
+            silences = []
+        segments = plan_segments(get_duration_ms(audiobook_path, pcm_cache), silences, count)
+        if plan:
+            plan.write_text(json.dumps({'count': count, 'segments': segments}))
+    con.print(f"Recognizing {len(segments)} segments with {count} {'threads' if pool else 'processes'}")
+
+    results = [None] * len(segments)
+    released = 0
+    executor = None
+    progress = build_progress(bar_type='file')
+    progress.disable = not show_progress
     try:
-        # Convert the file to wav (if needed), and stream output to file
-        # Start by getting the length (in seconds) of the mp3 file and converting that to wav file
-        # size in bytes, for the progress bar.
-        length = subprocess.run(["ffprobe", '-show_entries', 
-                                 'format=duration', '-i', audiobook_path], 
-                                text=True, capture_output=True).stdout
-        (_, length, _) = length.splitlines()
-        (_, length) = length.split('=')
-        # Length of .wav file is 2 bytes per sample, 16K samples per second.
-        length=int(float(length) * 16000 * 2)
-                                
-
-        with rich.progress.wrap_file(subprocess.Popen([str(ffmpeg), "-loglevel", "quiet", "-i",
-                               audiobook_path,
-                               "-ar", str(sample_rate), "-ac", "1", "-f", "s16le", "-"],
-                              stdout=subprocess.PIPE).stdout, length) as stream:
-            with open(out_file, 'w+') as fp:
-                fp.writelines(rec.SrtResult(stream, words_per_line = 1 ))
+        if pool:
+            submit = pool.submit
+        else:
+            executor = ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                                           initargs=(model_path, language, str(ffmpeg)))
+            submit = lambda *segment, **options: executor.submit(_recognize_worker, *segment, options)
+        with progress:
+            task = progress.add_task('', total=len(segments), verb='Recognizing', noun='segments...')
+            futures = {
+                submit(audiobook_path, start, end, **options): i
+                for i, (start, end) in enumerate(segments)
+            }
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+                progress.update(task, advance=1)
+                while on_words and released < len(results) and results[released] is not None:
+                    on_words(results[released])
+                    released += 1
+    finally:
+        if executor:
+            executor.shutdown()
+
+    return [word for segment in results for word in segment]
+
+
+def low_confidence_windows(words: list[dict], threshold: float, join_ms: int = 1000,
+                           padding_ms: int = 500) -> list[tuple[int, int, int, int]]:
+    """Find the stretches of audio where the recognizer wasn't sure of itself.
+
+    Words below threshold confidence that are less than join_ms apart are grouped together
+    (along with any confident words between them). Each window starts and ends halfway between
+    its outer words and their neighbours, so no word outside it is cut.
+
+    :param words: List of words, see result_words()
+    :param threshold: Words with a lower confidence than this are redone
+    :param join_ms: Doubtful words closer than this go in the same window
+    :param padding_ms: Audio to add before the first and after the last word of the book
+    :return: List of (first word, last word + 1, start ms, end ms)
+    """
+
+    windows = []
+    for i, word in enumerate(words):
+        if word['conf'] >= threshold:
+            continue
+        if windows and word['start'] - words[windows[-1][1] - 1]['end'] < join_ms:
+            windows[-1][1] = i + 1
+        else:
+            windows.append([i, i + 1])
+
+    result = []
+    for first, last in windows:
+        if first > 0:
+            start = words[first - 1]['end'] + (words[first]['start'] - words[first - 1]['end']) // 2
+        else:
+            start = max(0, words[first]['start'] - padding_ms)
+        if last < len(words):
+            end = words[last - 1]['end'] + (words[last]['start'] - words[last - 1]['end']) // 2
+        else:
+            end = words[last - 1]['end'] + padding_ms
+        result.append((first, last, start, end))
+
+    return result
+
+
+def refine_words(audiobook_path: PathLike, words: list[dict], model_path: Optional[Path], language: str,
+                 threshold: float, **options) -> list[dict]:
+    """Recognize the doubtful parts of a first pass over again with a better model.
+
+    The large models are several times slower than the small ones, but most of a book is
+    recognized just as well by both. So the small model does the whole book, and only the
+    windows with low confidence words (see low_confidence_windows()) go through the large model.
+    Its words replace the first pass's words in those windows.
+
+    :param audiobook_path: Path to input audiobook file
+    :param words: Words from the first pass, see result_words()
+    :param model_path: Path to the model for the second pass
+    :param language: Language of the model
+    :param threshold: Words with a lower confidence than this are redone
+    :param options: Passed on to recognize_segment() for every window
+    :return: List of words, with the windows replaced
+    """
+
+    windows = low_confidence_windows(words, threshold)
+    if not windows:
+        return words
+    length = sum(end - start for _, _, start, end in windows)
+    con.print(f"Recognizing {len(windows)} doubtful stretches ({length / 1000:.1f}s of audio) again")
+
+    model = load_model(model_path, language)
+    refined = []
+    done = 0
+    progress = build_progress(bar_type='file')
+    with progress:
+        task = progress.add_task('', total=len(windows), verb='Refining', noun='windows...')
+        for first, last, start, end in windows:
+            refined += words[done:first]
+            refined += recognize_segment(model, audiobook_path, start, end, **options)
+            done = last
+            progress.update(task, advance=1)
+    refined += words[done:]
+
+    return refined
+
+
+def srt_timestamp(ms: int) -> str:
+    """Format milliseconds as a srt timestamp, "00:00:00,000" """
+    hours, ms = divmod(ms, 3600000)
+    minutes, ms = divmod(ms, 60000)
+    seconds, ms = divmod(ms, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d},{ms:03d}"
+
+
+def write_srt(words: list[dict], out_file: PathLike) -> None:
+    """Write words out as a srt file, one word per record.
+
+    This is the same format KaldiRecognizer.SrtResult(words_per_line = 1) produces, and what
+    merge_srt.read_srt() expects. The file is written under a temporary name and renamed into
+    place, so it's never seen half written.
+
+    :param words: List of words, see result_words()
+    :param out_file: Path to the srt file
+    :return: None
+    """
+
+    temp = Path(f"{out_file}.tmp")
+    with open(temp, 'w+') as fp:
+        for counter, word in enumerate(words, start=1):
+            fp.write(f"{counter}\n{srt_timestamp(word['start'])} --> {srt_timestamp(word['end'])}\n{word['word']}\n\n")
+    os.replace(temp, out_file)
+
+
+def write_words(words: list[dict], out_file: PathLike) -> None:
+    """Write words out as a compact, columnar word timing file.
+
+    The file is a header (magic, version, word count, string count) followed by four arrays of
+    little endian 32 bit values: start (ms), end (ms), confidence (float) and an index into the
+    string table. The string table follows, as utf-8 words separated by newlines, each distinct
+    word stored once. See WordTimings for reading it back. Like write_srt(), the file is renamed
+    into place once complete.
+
+    :param words: List of words, see result_words()
+    :param out_file: Path to the word timing file
+    :return: None
+    """
+
+    table = {}
+    columns = [
+        array('I', (word['start'] for word in words)),
+        array('I', (word['end'] for word in words)),
+        array('f', (word['conf'] for word in words)),
+        array('I', (table.setdefault(word['word'], len(table)) for word in words))
+    ]
+    if sys.byteorder == 'big':
+        for column in columns:
+            column.byteswap()
+
+    temp = Path(f"{out_file}.tmp")
+    with open(temp, 'wb') as fp:
+        fp.write(words_header.pack(words_magic, words_version, len(words), len(table)))
+        for column in columns:
+            column.tofile(fp)
+        fp.write('\n'.join(table).encode('utf-8'))
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(temp, out_file)
+
+
+class WordTimings:
+    """Memory mapped, read only view of a word timing file written by write_words().
+
+    Loading doesn't depend on the length of the book: start, end, conf and word_id are views
+    straight into the file, and the string table is decoded in one go.
+    """
+
+    def __init__(self, words_path: PathLike):
+        with open(words_path, 'rb') as fp:
+            self.mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self.mmap)
+        if len(view) < words_header.size:
+            raise ValueError(f"{words_path} is too short to be a word timing file")
+        magic, version, self.count, strings = words_header.unpack_from(view)
+        if magic != words_magic or version != words_version:
+            raise ValueError(f"{words_path} is not a (version {words_version}) word timing file")
+        size = self.count * 4
+        if len(view) < words_header.size + size * 4:
+            raise ValueError(f"{words_path} is truncated")
+
+        columns = []
+        for i, code in enumerate('IIfI'):
+            column = view[words_header.size + i * size:words_header.size + (i + 1) * size].cast(code)
+            if sys.byteorder == 'big':
+                column = array(code, column)
+                column.byteswap()
+            columns.append(column)
+        self.start, self.end, self.conf, self.word_id = columns
+        self.table = str(view[words_header.size + size * 4:], 'utf-8').split('\n') if strings else []
+        if len(self.table) != strings:
+            raise ValueError(f"{words_path} has a damaged string table")
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def word(self, i: int) -> str:
+        """Return the text of word number i"""
+        return self.table[self.word_id[i]]
+
+    def words(self) -> list[dict]:
+        """Return every word as a dictionary, the same as result_words() does"""
+        return [
+            {'start': self.start[i], 'end': self.end[i], 'conf': self.conf[i], 'word': self.word(i)}
+            for i in range(self.count)
+        ]
+
+    def close(self) -> None:
+        """Release the views and unmap the file"""
+        for column in (self.start, self.end, self.conf, self.word_id):
+            if isinstance(column, memoryview):
+                column.release()
+        self.mmap.close()
+
+
+class WordStream:
+    """Hands recognized words from a recognizer thread to merge_srt while recognition goes on.
+
+    Without it, merging can't start until the whole book has been recognized. With it, the start
+    of the book is being merged while the end is still being recognized, so the run takes about as
+    long as the slower of the two, rather than both added up.
+
+    The queue is bounded: if merging falls behind, recognition waits for it, rather than piling
+    up the whole book in memory twice. Each item is the list of words of one vosk result.
+    """
+
+    def __init__(self, maxsize: int = 256):
+        self.queue = Queue(maxsize)
+        self.thread = None
+        self.error = None
+        self.cancelled = False
+        self.finished = False
+
+    def start(self, target: Callable, *args, **kwargs) -> None:
+        """Run target in a background thread. It should put() words as it recognizes them."""
+        def run():
+            try:
+                target(*args, stream=self, **kwargs)
+            except BaseException as e:
+                # Includes SystemExit, which is how generate_timecodes() reports failure
+                self.error = e
+            finally:
+                self.queue.put(None)
+
+        self.thread = Thread(target=run, name='recognizer', daemon=True)
+        self.thread.start()
+
+    def put(self, words: list[dict]) -> None:
+        """Queue words for merging. Blocks while the queue is full."""
+        if self.cancelled:
+            raise RuntimeError("Merging was stopped")
+        if words:
+            self.queue.put(words)
+
+    def __iter__(self):
+        """Yield lists of words until recognition is done. Re-raises any error it failed with."""
+        while not self.finished:
+            words = self.queue.get()
+            if words is None:
+                self.finished = True
+                break
+            yield words
+        if self.error:
+            raise self.error
+
+    def join(self) -> None:
+        """Discard the words nobody read, and wait for recognition to finish."""
+        for _ in self:
+            pass
+        self.thread.join()
+
+    def cancel(self) -> None:
+        """Stop recognition early, without raising its error"""
+        self.cancelled = True
+        try:
+            self.join()
+        except BaseException:
+            pass
+
+
+def check_srt(srt_path: PathLike) -> None:
+    """Check that a srt file with one word per record is whole, the way merge_srt.read_srt() reads it.
+
+    Counters have to run 1, 2, 3... and every record needs a timestamp line and a word, each ending
+    in a newline, so a file cut off in the middle of a record is caught.
+
+    :param srt_path: Path to the srt file
+    :raises ValueError: If the file has no words, or isn't whole
+    """
+
+    timestamp = re.compile(r'\d\d:\d\d:\d\d,\d\d\d --> \d\d:\d\d:\d\d,\d\d\d\n')
+    counter = 0
+    with open(srt_path, 'r') as srt:
+        while line := srt.readline():
+            counter += 1
+            if line != f"{counter}\n":
+                raise ValueError(f"{srt_path} has {line.rstrip()!r} where record {counter} should start")
+            if not timestamp.fullmatch(srt.readline()):
+                raise ValueError(f"{srt_path} record {counter} has no whole timestamp")
+            word = srt.readline()
+            if not word.endswith('\n') or not word.strip():
+                raise ValueError(f"{srt_path} record {counter} has no whole word")
+            if srt.readline() not in ('\n', ''):
+                raise ValueError(f"{srt_path} record {counter} isn't followed by a blank line")
+    if counter == 0:
+        raise ValueError(f"{srt_path} has no words")
+
+
+def find_timings(out_file: PathLike, srt_file: Optional[PathLike] = None) -> Optional[Path]:
+    """Find the result of an earlier recognition run, if there is a usable one.
+
+    :param out_file: Path to the word timing file
+    :param srt_file: Path to the srt file, which is all runs from before word timing files have
+    :return: Path to the word timing file, or to the srt file, or None
+    """
+
+    # Both are checked by reading them, not by their size: a book can have no words, and an
+    # interrupted run can leave a srt file that is long, but cut off
+    if out_file.exists():
+        try:
+            with WordTimings(out_file):
+                return out_file
+        except ValueError as e:
+            con.print(f"[bold yellow]WARNING:[/] Ignoring the existing word timing file: {e}")
+    if srt_file and srt_file.exists():
+        try:
+            check_srt(srt_file)
+            return srt_file
+        except ValueError as e:
+            con.print(f"[bold yellow]WARNING:[/] Ignoring the existing srt file, and recognizing again: {e}")
+
+    return None
+
+
+def generate_timecodes(audiobook_path: PathLike, out_file: PathLike, language: str, model_type: str,
+                       jobs: int = 1, threads: int = 1, pool: Optional[RecognizerPool] = None,
+                       srt_file: Optional[PathLike] = None, export_srt: bool = False, vad: bool = False,
+                       pcm_cache: Optional[PcmCache] = None, grammar: Optional[str] = None,
+                       stream: Optional[WordStream] = None, two_pass: Optional[float] = None) -> Path:
+    """Generate chapter timecodes using vosk Machine Learning API.
+
+    This function searches for the specified model/language within the project's 'models' directory and
+    uses it to perform a speech-to-text conversion on the audiobook, which is then saved in a word timing
+    file (see write_words()), and optionally also as a subrip (srt) file.
+
+    If more than 1 model is present, the script will attempt to guess which one to use based on input.
+
+    :param audiobook_path: Path to input audiobook file
+    :param out_file: Path to the word timing file to create
+    :param language: Language used by the parser
+    :param model_type: The type of model (large or small)
+    :param jobs: Number of recognizer processes. More than 1 splits the audio at long silences
+    :param threads: Number of recognizer threads sharing one model. Used instead of jobs if more than 1
+    :param pool: An existing RecognizerPool to use, so several books can share one loaded model
+    :param srt_file: Path to the srt file. Used if it already exists and the word timing file doesn't
+    :param export_srt: Also write the words out to srt_file
+    :param vad: Leave long silences out of what the recognizer sees, see VoiceActivityFilter
+    :param pcm_cache: PcmCache to read the audio from, instead of decoding it with ffmpeg
+    :param grammar: Vocabulary to restrict the recognizer to, see build_grammar(). Ignored (with a
+                    warning) for models that can't change their vocabulary at runtime
+    :param stream: WordStream to put words into as they are recognized. Recognition always runs
+                   then, so check for earlier results with find_timings() first
+    :param two_pass: Confidence threshold. If given, words below it are recognized again with the
+                     large model, see refine_words()
+    :return: Path to the word timing file, or to the srt file if that is all there is
+    """
+
+    # If the timecode file already exists, exit early and return path
+    if not stream and (timing_file := find_timings(out_file, srt_file)):
+        if timing_file == srt_file:
+            con.print("[bold green]SUCCESS![/] An existing srt timecode file was found")
+            return srt_file
+        if export_srt and srt_file and not srt_file.exists():
+            with WordTimings(out_file) as timings:
+                write_srt(timings.words(), srt_file)
+            con.print("[bold green]SUCCESS![/] Timecode file exported as srt")
+        con.print("[bold green]SUCCESS![/] An existing word timing file was found")
+
+        return out_file
+
+    model_path = find_model(language, model_type)
+    if grammar and not supports_grammar(pool.model_path if pool else model_path):
+        con.print(
+            "[bold yellow]WARNING:[/] The model can't be restricted to the ebook's vocabulary "
+            "(only models with a graph/HCLr.fst can). Using its full vocabulary."
+        )
+        grammar = None
+    # Finalized words are committed here as they are recognized, so an interrupted run can resume
+    checkpoints = Path(f"{out_file}.partial")
+    checkpoints.mkdir(exist_ok=True)
+    options = {'checkpoints': checkpoints, 'vad': vad, 'pcm_cache': pcm_cache, 'grammar': grammar}
+    # Merging shows its own progress bar while streaming, and there can only be one at a time
+    on_words = stream.put if stream else None
+
+    try:
+        if pool:
+            words = recognize_parallel(audiobook_path, model_path, language, jobs, pool, not stream, on_words,
+                                       **options)
+        elif threads > 1:
+            with RecognizerPool(model_path, language, threads) as pool:
+                words = recognize_parallel(audiobook_path, model_path, language, jobs, pool, not stream, on_words,
+                                           **options)
+        elif jobs > 1:
+            words = recognize_parallel(audiobook_path, model_path, language, jobs, show_progress=not stream,
+                                       on_words=on_words, **options)
+        else:
+            model = load_model(model_path, language)
+            words = recognize_segment(model, audiobook_path, 0, get_duration_ms(audiobook_path, pcm_cache),
+                                      show_progress=not stream, on_words=on_words, **options)
+
+        if two_pass is not None:
+            large_path = find_model(language, 'large')
+            if large_path == (pool.model_path if pool else model_path):
+                con.print("[bold yellow]WARNING:[/] No large model to make a second pass with, skipping it")
+            else:
+                refinements = checkpoints / 'refine'
+                refinements.mkdir(exist_ok=True)
+                words = refine_words(audiobook_path, words, large_path, language, two_pass,
+                                     checkpoints=refinements, pcm_cache=pcm_cache)
+
+        write_words(words, out_file)
+        if export_srt and srt_file:
+            write_srt(words, srt_file)
+        rmtree(checkpoints)
 
         con.print("[bold green]SUCCESS![/] Timecode file created\n")
     except Exception as e:
@@ -645,6 +1829,254 @@ def generate_timecodes(audiobook_path: PathLike, out_file: PathLike, language: s
     return Path(out_file)
 
 
+# Idle espeak backends by language, for spare_espeak()
+_spare_espeak = {}
+_spare_espeak_lock = Lock()
+
+
+@contextmanager
+def spare_espeak(language: str):
+    """Lend out an espeak backend for language, for a thread that needs its own for a while.
+
+    Backends are given back when the thread is done, and lent out again the next time, so a long
+    running worker doesn't start a new espeak for every book.
+
+    :param language: espeak language
+    """
+    with _spare_espeak_lock:
+        idle = _spare_espeak.setdefault(language, [])
+        espeak = idle.pop() if idle else None
+    espeak = espeak or EspeakBackend(language)
+    try:
+        yield espeak
+    finally:
+        with _spare_espeak_lock:
+            _spare_espeak[language].append(espeak)
+
+
+def phonemize_batch(espeak: EspeakBackend, texts: list[str]) -> list[str]:
+    """Phonemize a list of texts in one call, the same way merge_srt.to_phenomes() does each one.
+
+    :param espeak: espeak backend to use
+    :param texts: Texts (normally single words) to phonemize
+    :return: Phonemes of each text, with a single trailing space
+    """
+
+    result = espeak.phonemize(texts)
+    if len(result) != len(texts):
+        # Shouldn't happen, but phonemizer is allowed to drop empty lines
+        result = [espeak.phonemize([text])[0] for text in texts]
+    return [phonemes.rstrip().lstrip()+" " for phonemes in result]
+
+
+class PhonemeCache:
+    """Word to phoneme cache, kept in a sqlite database and shared by every book and run.
+
+    Most of every book is the same few thousand words, so after a few books almost nothing is
+    left for espeak to do. The chunks of ebooks are kept here too, each one phonemized on its
+    own like a word is. Entries are keyed by espeak language and version, as well as the
+    (unicode normalized) word, so a new espeak doesn't get the old one's phonemes.
+
+    The most recently used entries are also kept in memory, in front of the database. The database
+    is in WAL mode, so parallel jobs can read it while another one writes; each thread gets its
+    own connection.
+    """
+
+    def __init__(self, path: PathLike, size: int = 100000):
+        self.path = Path(path)
+        self.size = size
+        self.recent = OrderedDict()
+        self.lock = Lock()
+        self.local = local()
+
+    def __reduce__(self):
+        # Connections and locks don't travel. A new process starts with an empty LRU
+        return self.__class__, (self.path, self.size)
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if not hasattr(self.local, 'db'):
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=60)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS phonemes (language TEXT, version TEXT, word TEXT, phonemes TEXT, '
+                'PRIMARY KEY (language, version, word)) WITHOUT ROWID'
+            )
+            db.commit()
+            self.local.db = db
+        return self.local.db
+
+    @staticmethod
+    def key(espeak: EspeakBackend) -> tuple[str, str]:
+        """The (language, version) entries made with espeak are stored under"""
+        return espeak.language, '.'.join(str(v) for v in espeak.version())
+
+    def get_many(self, key: tuple[str, str], words: list[str]) -> dict[str, str]:
+        """Look words up, in memory first, then in the database.
+
+        :param key: espeak (language, version)
+        :param words: Words to look up
+        :return: Dictionary of the words that were found, and their phonemes
+        """
+
+        found = {}
+        missing = {}
+        with self.lock:
+            for word in words:
+                normal = (*key, unicodedata.normalize('NFC', word))
+                if normal in self.recent:
+                    self.recent.move_to_end(normal)
+                    found[word] = self.recent[normal]
+                else:
+                    missing.setdefault(normal[2], []).append(word)
+
+        missed = list(missing)
+        for i in range(0, len(missed), 500):
+            chunk = missed[i:i + 500]
+            rows = self.db.execute(
+                f"SELECT word, phonemes FROM phonemes WHERE language = ? AND version = ? "
+                f"AND word IN ({','.join('?' * len(chunk))})",
+                (*key, *chunk)
+            ).fetchall()
+            self._remember(key, rows)
+            for normal, phonemes in rows:
+                for word in missing[normal]:
+                    found[word] = phonemes
+
+        return found
+
+    def put_many(self, key: tuple[str, str], phonemes: dict[str, str]) -> None:
+        """Store words and their phonemes. Words some other job stored first are left alone."""
+        rows = [(unicodedata.normalize('NFC', word), text) for word, text in phonemes.items()]
+        with self.db as db:
+            db.executemany(
+                "INSERT OR IGNORE INTO phonemes (language, version, word, phonemes) VALUES (?, ?, ?, ?)",
+                ((*key, word, text) for word, text in rows)
+            )
+        self._remember(key, rows)
+
+    def _remember(self, key: tuple[str, str], rows: list[tuple[str, str]]) -> None:
+        with self.lock:
+            for word, text in rows:
+                self.recent[(*key, word)] = text
+                self.recent.move_to_end((*key, word))
+            while len(self.recent) > self.size:
+                self.recent.popitem(last=False)
+
+    def close(self) -> None:
+        """Close this thread's connection"""
+        if hasattr(self.local, 'db'):
+            self.local.db.close()
+            del self.local.db
+
+
+class SearchWindow:
+    """Predicts where in the recognized text the next chunk of the book is, for merge_srt.write_text()
+
+    Mostly a chunk starts right where the last one ended, give or take a few words the narrator
+    added or the recognizer made up. So the window starts out tight, and takes in about twice the
+    most text recently skipped before a match. After a chunk isn't found, the next one is expected
+    that much further along (the narrator did read it), give or take more the more went missing.
+    The slack never goes below a couple of seconds of speech, at the rate recent matches were
+    spoken at.
+    """
+
+    def __init__(self, history: int = 16, seconds: float = 2.0):
+        """
+        :param history: Number of recent matches to go by
+        :param seconds: Least slack, in seconds of speech
+        """
+        self.skips = deque(maxlen=history)
+        self.seconds = seconds
+        # Phonemes per second of recent matches, and phonemes of the book not found since
+        self.rate = None
+        self.backlog = 0
+        # Chunks in a row that weren't found
+        self.lost = 0
+
+    def predict(self, offset: int, length: int) -> tuple[int, int]:
+        """Window (start, end) of srt_text to search first, for a chunk of length phonemes.
+
+        :param offset: Where the last match ended
+        """
+        slack = max(2 * max(self.skips, default=0), int((self.rate or 50) * self.seconds)) + self.backlog // 4
+        center = offset + self.backlog
+        return max(offset, center - slack), center + slack + length + length // 4
+
+    def matched(self, skipped: int, length: int, ms: int) -> None:
+        """A chunk was found skipped characters past the last match, length characters long, lasting ms"""
+        self.skips.append(skipped)
+        if ms > 0:
+            rate = length * 1000 / ms
+            self.rate = rate if self.rate is None else 0.8 * self.rate + 0.2 * rate
+        self.backlog = 0
+        self.lost = 0
+
+    def missed(self, length: int) -> None:
+        """A chunk of length phonemes wasn't found"""
+        self.backlog += length + 1
+        self.lost += 1
+
+
+class PhonemeIndex:
+    """Where each three phoneme words in a row occur in the recognized text, for merge_srt.write_text()
+
+    Once the merge has lost its place, the chunks it can't find are looked up here. The chunk's
+    own phoneme trigrams vote for where it starts, and the place with the most votes is where
+    to search for it. Trigrams that occur all over the book don't say where anything is, and
+    don't get a vote.
+    """
+
+    def __init__(self, n: int = 3, common: int = 50):
+        """
+        :param n: Number of phoneme words in a gram
+        :param common: Grams occurring more often than this don't vote
+        """
+        self.n = n
+        self.common = common
+        self.grams = {}
+        # Offset in srt_text of every phoneme word indexed, and the words the next gram starts with
+        self.starts = array('I')
+        self.tail = []
+        self.indexed = 0
+
+    def update(self, srt_text: str) -> None:
+        """Index the text added to srt_text since the last update"""
+        if self.indexed == len(srt_text):
+            return
+        for match in re.finditer(r'\S+', srt_text[self.indexed:]):
+            self.starts.append(self.indexed + match.start())
+            self.tail.append(match.group())
+            if len(self.tail) == self.n:
+                positions = self.grams.setdefault(' '.join(self.tail), array('I'))
+                positions.append(len(self.starts) - self.n)
+                del self.tail[0]
+        self.indexed = len(srt_text)
+
+    def locate(self, ptext: str, after: int, before: Optional[int] = None, votes: int = 2) -> Optional[int]:
+        """Offset in srt_text where ptext most likely starts, at or after after, if anywhere.
+
+        :param before: If given, only places starting before this offset are considered
+        :param votes: Least number of trigrams of ptext that have to agree
+        """
+        tokens = ptext.split()
+        first = bisect_right(self.starts, after - 1)
+        last = len(self.starts) if before is None else bisect_left(self.starts, before)
+        tally = {}
+        for i in range(len(tokens) - self.n + 1):
+            positions = self.grams.get(' '.join(tokens[i:i + self.n]), ())
+            if len(positions) > self.common:
+                continue
+            for position in positions:
+                if first <= position - i < last:
+                    tally[position - i] = tally.get(position - i, 0) + 1
+        best = max(tally, key=lambda start: (tally[start], -start), default=None)
+        if best is None or tally[best] < votes:
+            return None
+        return self.starts[best]
+
+
 class merge_srt:
     """Correct text from speach recognition with actual book text.
 
@@ -672,11 +2104,31 @@ class merge_srt:
         <numeric id of wav/mp3>|<text spoken>
     """
 
-    def __init__(self, srt_path: PathLike, text_path: PathLike, csv_path: PathLike):
+    def __init__(self, timing_path: PathLike, text_path: PathLike, csv_path: PathLike,
+                 espeak: Optional[EspeakBackend] = None, stream: Optional[WordStream] = None,
+                 phonemes: Optional[PhonemeCache] = None, align: str = 'greedy', jobs: int = 1,
+                 language: str = 'en-us', speculate: int = 0, log_rejected: bool = False):
         """ Merge the SRT data with ebook data to create the list of start/stop times with text
 
         Since text is from the ebook file, not the speach recognition, this can then be used to 
         train TTS and for other AI training purposes.
+
+        An already initialized espeak backend can be passed in, so a long running worker doesn't
+        have to start a new one for every book.
+
+        If a WordStream is given, words are taken from it as recognition produces them, instead of
+        from timing_path, and merging waits whenever it gets ahead of recognition.
+
+        Recognized words are looked up in (and added to) phonemes, if given.
+
+        align chooses how chunks of the book are matched up with the recognized text: 'greedy'
+        matches each chunk in turn, right after the last match. 'anchors' first pins the book
+        down at places that can't be mistaken, see merge_anchored(), and uses jobs processes.
+        'global' aligns the whole book in one go, see merge_global(). 'chapters' merges each
+        chapter on its own, see merge_chapters(), finding them by the chapter markers of language.
+        The greedy merge searches for up to speculate chunks ahead, in jobs processes, see
+        merge_speculative(). Matches that weren't good enough are logged as M records if
+        log_rejected.
         """
         # First, check if the .csv file already exists. If so, just read it in to fill out 
         # self.slicelist, and return.
@@ -688,16 +2140,16 @@ class merge_srt:
             return
 
 
-        # Read the srt file produced by vosk. This file is ONE WORD per srt record, and
-        # is used because it contains the offsets in the audio file for the begining AND END of each
-        # word.
-        self.espeak = EspeakBackend('en-us')
-        self.srt_text = ""
-        self.srt_offsets = []
-        self.srt_times = []
-        self.srt_offset = 0
-        self.srt_gtext = []
-        self.read_srt(srt_path)
+        # Read the word timings produced by vosk. This is either a word timing file, or a srt file
+        # with ONE WORD per srt record, and is used because it contains the offsets in the audio file
+        # for the begining AND END of each word.
+        self.init_words(espeak, stream, phonemes)
+        if stream:
+            pass  # Read as needed, see fill()
+        elif Path(timing_path).suffix == '.srt':
+            self.read_srt(timing_path)
+        else:
+            self.read_words(timing_path)
 
         # logfile is our actual output, and contains a record for each matching text, and each bit
         # of text skipped either in the srt file (the speach recognition file) and the text file.
@@ -706,9 +2158,15 @@ class merge_srt:
         self.bookonlytext = 0
         self.srtonlytext = 0
         self.goodtext = 0
+        self.align = align
+        self.jobs = jobs
+        self.language = language
+        self.speculate = speculate
+        self.log_rejected = log_rejected
         self.logfile = open(csv_path,'w')
         self.read_text(text_path)
         self.logfile.close()
+        self.write_stats(Path(csv_path).with_suffix('.metrics.json'))
         if self.goodtext < self.bookonlytext + self.srtonlytext:
             con.print("[bold red]ERROR![/] Merge failed more than succeded! Wrong text file? Empty text file?")
             con.print("In any case, a high failure-to-match rate probably means you really don't want to slice.")
@@ -723,6 +2181,84 @@ class merge_srt:
 
 
 
+    @classmethod
+    def from_words(cls, words :list[dict], espeak :EspeakBackend, logfile,
+                   phonemes :Optional[PhonemeCache] = None) -> 'merge_srt':
+        """ Set up merging against just the given words, with records written to logfile
+
+        Nothing is read or merged yet: call write_text() for each chunk of text. This is used to
+        merge parts of a book over again, see repair_csv().
+        """
+        self = cls.__new__(cls)
+        self.slicelist = []
+        self.init_words(espeak, [words], phonemes)
+        self.bookonlytext = 0
+        self.srtonlytext = 0
+        self.goodtext = 0
+        self.align = 'greedy'
+        self.jobs = 1
+        self.language = 'en-us'
+        self.logfile = logfile
+        return self
+
+
+    def write_stats(self, metrics_path :PathLike):
+        """ Print a summary of how the merge went, and save the statistics as json to metrics_path """
+        metrics = {'good': self.goodtext, 'book_only': self.bookonlytext, 'srt_only': self.srtonlytext,
+                   **self.stats}
+        with open(metrics_path, 'w') as out:
+            json.dump(metrics, out, indent=2)
+        levels = ', '.join(f"{match_label(level)}: {self.stats[match_label(level)]}"
+                           for level in range(len(match_levels)))
+        con.print(f"Chunks matched at each edit distance: {levels}. {self.bookonlytext} didn't match")
+        if sizes := self.stats['window_sizes']:
+            con.print(f"{self.stats['window_hits']} of {len(sizes)} chunks were found in the predicted window "
+                      f"(average {sum(sizes) // len(sizes)} characters)")
+        if self.stats['resyncs']:
+            con.print(f"Lost the place in the recognized text, and found it again, {self.stats['resyncs']} times")
+        if self.stats['speculated']:
+            con.print(f"{self.stats['speculated']} of {self.stats['searches']} searches came from a "
+                      "speculative search")
+
+
+    def init_words(self, espeak :Optional[EspeakBackend], stream, phonemes :Optional[PhonemeCache] = None):
+        """ Start out with no words. stream, if given, is an iterable of lists of words, see fill() """
+        self.espeak = espeak or EspeakBackend('en-us')
+        self.phonemes = phonemes
+        self.phonemes_key = PhonemeCache.key(self.espeak)
+        # One entry per recognized word, in typed arrays: a python int or tuple per word adds up
+        # to hundreds of MB for a long book. The words themselves are stored once each in
+        # srt_table, see srt_word()
+        self.srt_text = ""
+        self.srt_offsets = array('I')
+        self.srt_starts = array('I')
+        self.srt_ends = array('I')
+        self.srt_words = array('I')
+        self.srt_table = []
+        self.srt_table_ids = {}
+        # For every character of srt_text, the first word starting at or after it, see to_ms()
+        self.srt_char_words = array('I')
+        self.srt_offset = 0
+        # Matches may not go past this offset, if set
+        self.srt_limit = None
+        self.speculate = 0
+        self.log_rejected = False
+        # Where to search for the next chunk first, see write_text(), and where to look for it
+        # once resync_after chunks in a row weren't found, up to resync_reach characters on
+        # (about two hours of speech)
+        self.window = SearchWindow()
+        self.index = PhonemeIndex()
+        self.resync_after = 3
+        self.resync_reach = 100000
+        # Searches done, how many of them came from merge_speculative(), the size of the windows
+        # from self.window and how often the chunk was in them, and the number of chunks matched
+        # at each of match_levels. resyncs counts the chunks found through self.index
+        self.stats = {'searches': 0, 'speculated': 0, 'window_sizes': [], 'window_hits': 0, 'window_misses': 0,
+                      'resyncs': 0}
+        self.stats.update((match_label(level), 0) for level in range(len(match_levels)))
+        self.stream = iter(stream) if stream else None
+
+
     def read_csv(self, csv_file: PathLike):
         """ Read the csv file into a self.slicelist """
         with open(csv_file,'r') as csv:
@@ -739,18 +2275,11 @@ class merge_srt:
 
     def read_srt(self, srt_path: PathLike):
         counter = 1
-        progress = build_progress("file")
+        first = len(self.srt_words)
         with open(srt_path, 'r') as srt:
             # Read the srt file in by records
-            task = progress.add_task('', total=os.fstat(srt.fileno()).st_size, verb='Phonemizing', noun='srt file..')
             line = "\n"
-            position = srt.tell()
-            progress.start()
-            progress.start_task(task)
             while line != "":
-                progress.update(task, advance = srt.tell() - position)
-                position = srt.tell()
-
                 # First line of each record is always a strictly increasing integer counter
                 line = srt.readline()
                 if line == '':
@@ -770,18 +2299,137 @@ class merge_srt:
                 if " " in line:
                     con.print( f"[bold red]CRITICAL:[/] words may not contain a space! at line {srt.newlines}")
                     sys.exit(1)
-                self.srt_times += [(start, stop)]
-                self.srt_offsets += [len(self.srt_text)]
-                self.srt_gtext += [line]
-                line = self.to_phenomes(line)
-                self.srt_text += line
+                self.srt_starts.append(start)
+                self.srt_ends.append(stop)
+                self.srt_words.append(self.srt_word_id(line.rstrip("\n")))
 
                 # Seperated by a blank line.
                 line = srt.readline()
                 if line != "" and line != "\n":
                     con.print(f"[bold red]CRITICAL:[/] synchronization error at line {srt.newlines}: unexpected non-blank line, got {line}")
                     sys.exit(1)
-            progress.stop()
+        self.add_phonemes(first, show_progress=True)
+
+
+    def read_words(self, words_path: PathLike):
+        """ Read a word timing file, see write_words()
+
+        The file already has every distinct word just once, so that is what gets phonemized.
+        """
+        first = len(self.srt_words)
+        with WordTimings(words_path) as timings:
+            ids = [self.srt_word_id(word) for word in timings.table]
+            # Straight from column to column, without a python object per word in between
+            self.srt_starts.extend(timings.start)
+            self.srt_ends.extend(timings.end)
+            self.srt_words.extend(ids[word_id] for word_id in timings.word_id)
+        self.add_phonemes(first, show_progress=True)
+
+
+    def add_phonemes(self, first :int, show_progress :bool = False):
+        """ Phonemize the words from number first on, and add them to the srt text
+
+        For words that have been put in srt_starts, srt_ends and srt_words already. Only the
+        distinct words are phonemized, and the srt text is put together in one go.
+        """
+        phonemes = self.phonemize_many(self.srt_table, show_progress)
+        ids = self.srt_words[first:]
+        self.srt_offsets.extend(accumulate((len(phonemes[word_id]) for word_id in ids), initial=len(self.srt_text)))
+        self.srt_offsets.pop()
+        self.srt_text += ''.join(phonemes[word_id] for word_id in ids)
+        self.index_chars(first)
+
+
+    def index_chars(self, first :int):
+        """ Extend srt_char_words over the words from number first on
+
+        The first character of word i belongs to i, the rest of it to i + 1. That's what
+        bisect_left() on srt_offsets would come up with, so to_ms() can just look it up.
+        """
+        ends = chain(self.srt_offsets[first + 1:], (len(self.srt_text),))
+        self.srt_char_words.extend(chain.from_iterable(
+            chain((i,), repeat(i + 1, end - start - 1))
+            for i, start, end in zip(range(first, len(self.srt_offsets)), self.srt_offsets[first:], ends)
+        ))
+
+
+    def add_words(self, words :list[tuple[int, int, str]], phonemes :Optional[list[str]] = None,
+                  show_progress :bool = False):
+        """ Append recognized words, as (start ms, stop ms, word)
+
+        phonemes are the words' to_phenomes(), if they are already known.
+        The srt text is put together in one go: adding to it word by word copies all of it every time.
+        """
+        if phonemes is None:
+            phonemes = self.phonemize_many([word for _, _, word in words], show_progress)
+        first = len(self.srt_words)
+        offset = len(self.srt_text)
+        for (start, stop, word), text in zip(words, phonemes):
+            self.srt_starts.append(start)
+            self.srt_ends.append(stop)
+            self.srt_offsets.append(offset)
+            self.srt_words.append(self.srt_word_id(word))
+            offset += len(text)
+        self.srt_text += ''.join(phonemes)
+        self.index_chars(first)
+
+
+    def srt_word_id(self, word :str) -> int:
+        """ Index of word in srt_table, adding it if it's new """
+        if (word_id := self.srt_table_ids.get(word)) is None:
+            word_id = self.srt_table_ids[word] = len(self.srt_table)
+            self.srt_table.append(word)
+        return word_id
+
+
+    def srt_word(self, i :int) -> str:
+        """ The recognized word (as text, not phonemes) number i """
+        return self.srt_table[self.srt_words[i]]
+
+
+    def phonemize_many(self, texts :list[str], show_progress :bool = False, batch :int = 1000,
+                       espeak :Optional[EspeakBackend] = None) -> list[str]:
+        """ to_phenomes() for a list of texts
+
+        A book is a few hundred thousand words, but only some thousands of different ones. Each
+        distinct text is phonemized once, and they are handed to espeak in batches, rather than
+        paying the per call overhead for every word. The results are the same as calling
+        to_phenomes() on each text. With a PhonemeCache, only the texts it doesn't have yet go
+        to espeak.
+
+        :param espeak: The espeak to use, if not self.espeak
+        """
+        unique = list(dict.fromkeys(texts))
+        known = self.phonemes.get_many(self.phonemes_key, unique) if self.phonemes else {}
+        if known:
+            unique = [text for text in unique if text not in known]
+        new = {}
+        progress = build_progress("file")
+        progress.disable = not show_progress or not unique
+        with progress:
+            task = progress.add_task('', total=len(unique), verb='Phonemizing', noun='words..')
+            for i in range(0, len(unique), batch):
+                chunk = unique[i:i + batch]
+                new.update(zip(chunk, phonemize_batch(espeak or self.espeak, chunk)))
+                progress.update(task, advance=len(chunk))
+        if self.phonemes and new:
+            self.phonemes.put_many(self.phonemes_key, new)
+        known.update(new)
+        return [known[text] for text in texts]
+
+
+    def fill(self, offset :int):
+        """ When streaming, take recognized words until the srt text extends past offset
+
+        The text has to go at least one word past the end of the search window: to_ms() for a
+        match at the very end would come out different once the next word shows up.
+        """
+        while self.stream and len(self.srt_text) <= offset:
+            words = next(self.stream, None)
+            if words is None:
+                self.stream = None
+                break
+            self.add_words([(word['start'], word['end'], word['word']) for word in words])
 
 
     def srt_time_to_ms(self, time :str) -> int:
@@ -821,25 +2469,43 @@ class merge_srt:
         Start time is halfway between the start of the current word 
         and the end of the previous word
         """
-        from bisect import bisect_left
+        return self.to_ms_many((offset,))[0]
 
-        pos = bisect_left(self.srt_offsets, offset)
-        if pos == 0:
-            return self.srt_times[pos][0]
-        if pos == len(self.srt_offsets):
-            return self.srt_times[pos-1][1]
-        before = self.srt_offsets[pos - 1]
-        after = self.srt_offsets[pos]
-        if after - offset >= offset - before:
-            # We were handed an offset close to the begining of a word
-            pos = pos - 1
 
-        # This is the "normal" case. 
-        # Return a spot halfway between this word and the previous one.
-        return self.srt_times[pos - 1][1] + (self.srt_times[pos][0] -  self.srt_times[pos - 1][1]) // 2
+    def to_ms_many(self, offsets) -> list[int]:
+        """ to_ms() for several offsets at once
 
-
-    def quotesplit(self, text :str ) -> list:
+        The word each offset falls in is looked up in srt_char_words, rather than searched for.
+        """
+        char_words = self.srt_char_words
+        words = self.srt_offsets
+        starts = self.srt_starts
+        ends = self.srt_ends
+        count = len(words)
+        if count == 0:
+            # Nothing was recognized, so there's no time to go by
+            return [0 for _ in offsets]
+        result = []
+        for offset in offsets:
+            pos = char_words[offset] if offset < len(char_words) else count
+            if pos == 0:
+                result.append(starts[pos])
+                continue
+            if pos == count:
+                result.append(ends[pos-1])
+                continue
+            if words[pos] - offset >= offset - words[pos - 1]:
+                # We were handed an offset close to the begining of a word
+                pos = pos - 1
+
+            # This is the "normal" case. 
+            # Return a spot halfway between this word and the previous one.
+            result.append(ends[pos - 1] + (starts[pos] -  ends[pos - 1]) // 2)
+        return result
+
+
+    @staticmethod
+    def quotesplit(text :str ) -> list:
         """ Split a paragraph string into speach/non speach chunks
 
         Keeps quotes with speach parts.
@@ -869,20 +2535,94 @@ class merge_srt:
         return output
 
     def read_text(self, text_path :PathLike):
+        """ Merge the ebook, chunk by chunk
+
+        The chunks are phonemized by phonemize_text() on another thread, which keeps up to
+        queue_size lines ahead. So espeak and the fuzzy search each get on with their own part,
+        instead of taking turns.
+        """
+
+        executor = None
+        if self.speculate and self.align == 'greedy' and not self.stream:
+            # Start the processes merge_speculative() searches in now: forking once the phonemizer
+            # thread is running could copy a lock it holds, and hang the new process. The first job
+            # submitted starts them all
+            executor = ProcessPoolExecutor(max_workers=self.jobs, initializer=_init_speculation,
+                                           initargs=(self.srt_text,))
+            executor.submit(int).result()
 
         # Begin processing ebook file by reading it into chunks
         progress = build_progress("file")
-        with open(text_path,'r') as text:
-            task = progress.add_task('', total = os.fstat(text.fileno()).st_size, verb='merging', noun='text')
-            progress.start()
-            progress.start_task(task)
-            # Read all paragraphs, split them into chunks.
-            # After this point, paragraphs are marked by double spaces.
-            for line in text:
-                progress.update(task, advance = len(line))
-                for chunk in self.quotesplit(dumbquote(line.rstrip())):
-                    self.write_text(chunk)
+        chunks = Queue(maxsize=256)
+        stopping = Event()
+        producer = Thread(target=self.phonemize_text, args=(text_path, chunks, stopping), name='phonemizer',
+                          daemon=True)
+        producer.start()
+        task = progress.add_task('', total = os.stat(text_path).st_size, verb='merging', noun='text')
+        progress.start()
+        progress.start_task(task)
+
+        def phonemized():
+            while (item := chunks.get()) is not None:
+                if isinstance(item, BaseException):
+                    raise item
+                advance, lines = item
+                progress.update(task, advance = advance)
+                yield from lines
+
+        book = []
+        try:
+            if self.align != 'greedy':
+                # Needs the whole book first
+                book = list(phonemized())
+            elif executor:
+                self.merge_speculative(phonemized(), self.speculate, executor)
+            else:
+                for chunk, ptext in phonemized():
+                    self.write_text(chunk, ptext)
+        finally:
+            # If merging failed, the producer may be stuck on a full queue: tell it to stop, and
+            # make room until it has
+            stopping.set()
+            while producer.is_alive():
+                try:
+                    chunks.get(timeout=0.1)
+                except Empty:
+                    pass
             progress.stop()
+            if executor:
+                executor.shutdown(cancel_futures=True)
+        if self.align == 'anchors':
+            self.merge_anchored(book)
+        elif self.align == 'global':
+            self.merge_global(book)
+        elif self.align == 'chapters':
+            self.merge_chapters(book)
+
+
+    def phonemize_text(self, text_path :PathLike, chunks :Queue, stopping :Event):
+        """ Read the ebook, split it into chunks, and phonemize them, for read_text()
+
+        Puts (characters read, [(chunk, phonemes), ...]) for each line on chunks, then None.
+        If anything goes wrong, the exception is put on chunks instead. Gives up once stopping is
+        set. This borrows its own espeak (see spare_espeak()), since an espeak backend can't be used
+        by two threads at once. Chunks already in the phoneme cache, from --build-lexicon or an earlier
+        run, are looked up instead. Each chunk is phonemized on its own either way, so that gives
+        the same phonemes.
+        """
+        try:
+            with spare_espeak(self.espeak.language) as espeak, open(text_path,'r') as text:
+                # Read all paragraphs, split them into chunks.
+                # After this point, paragraphs are marked by double spaces.
+                for line in text:
+                    if stopping.is_set():
+                        return
+                    split = self.quotesplit(dumbquote(line.rstrip()))
+                    chunks.put((len(line), list(zip(split, self.phonemize_many(split, espeak=espeak)))))
+        except BaseException as e:
+            chunks.put(e)
+            return
+        chunks.put(None)
 
 
     def log(self, logtype :str, start :int, stop :int, text :[str] ) -> None:
@@ -915,7 +2655,8 @@ class merge_srt:
             self.slicelist += [{ "start": int(start), "end": int(stop), "text": t }]
 
 
-    def write_text(self, text :str) -> None:
+    def write_text(self, text :str, ptext :Optional[str] = None,
+                   guess :Optional[tuple[list[tuple[str, int, int]], tuple]] = None) -> None:
         """ Write text given out to the csv file
 
         Text should come from the chapter, not the SRT (speak recognition) and is matched with the
@@ -924,57 +2665,788 @@ class merge_srt:
         Format is pipe seperated, and is type, start, stop, text
         where "type" is "G"ood, "S"rt text discarded, or "B"ook text discarded
         SRT text discarded has valid timestamps, Book text discarded has start=stop
+
+        ptext is text's to_phenomes(), if it's already known.
+
+        guess is (windows, result) from running search_chunk() ahead of time, see
+        merge_speculative(). It's used instead of searching again, if the windows are the same.
         """
-        ptext = self.to_phenomes(text)
+        if ptext is None:
+            ptext = self.to_phenomes(text)
+
+        windows = self.search_plan(ptext, self.srt_offset, self.window)
+        for name, lo, hi in windows:
+            if name == 'predicted':
+                self.stats['window_sizes'].append(hi - lo)
+        if guess is not None and guess[0] == windows:
+            name, base, level, match, rejected, searches = guess[1]
+            self.stats['speculated'] += searches
+        else:
+            name, base, level, match, rejected, searches = search_chunk(ptext, self.srt_text, windows)
+        self.stats['searches'] += searches
+        self.log_rejected_matches(rejected, ptext)
+        if match is not None:
+            start, end, _ = match
+            self.stats[match_label(level)] += 1
+            if name == 'index':
+                self.stats['resyncs'] += 1
+            elif any(other == 'predicted' for other, _, _ in windows):
+                self.stats['window_hits' if name == 'predicted' else 'window_misses'] += 1
+            startms, endms = self.to_ms_many((start, end))
+            self.window.matched(start - (base if name == 'index' else self.srt_offset), end - start,
+                                endms - startms)
+            # write skipped SRT text
+            if start != self.srt_offset:
+                #TODO: Log the original text from the .srt file as well.
+                self.log("S",self.to_ms(self.srt_offset), 
+                     startms,
+                     [self.srt_text[self.srt_offset:start]])
+            self.log("G",startms, endms,
+                              [ptext, 
+                               self.srt_text[start:end], 
+                               text] )
+            self.srt_offset = end
+            return
+        if any(name == 'predicted' for name, _, _ in windows):
+            self.stats['window_misses'] += 1
+        self.window.missed(len(ptext))
+        # No good matches, discard the text.
+        ms = self.to_ms(self.srt_offset)
+        self.log("B", ms, ms, [ptext, text] )
+
+
+    def search_plan(self, ptext :str, offset :int, window :SearchWindow) -> list[tuple[str, int, int]]:
+        """ The windows of srt_text write_text() searches for ptext in, in turn, as (name, start, end)
 
+        :param offset: Where the last match ended
+        :param window: Predicts where ptext is, see SearchWindow
+        """
         # Fuzzysearch is EXPENSIVE, and the real bottleneck in this process.
         # To limit that, limit the length of the text we're searching inside to just the start
         # of the ebook, not the whole thing. (fuzzysearch doesn't stop after finding the first
         # match, AND we really don't want to skip the whole damned book because "chapter 3"
         # accidentally matched chapter 39.
 
-        # For longer paragraphs, only search the first bit of the book
-        # It'll match right away or not at all. (Search double the paragraph length)
-        if len(ptext) > 80:
-            end = self.srt_offset+len(ptext)+len(ptext)
+        # String slicing doesn't get indexErrors, so we don't need to limit this.
+        end = offset + search_window(ptext)
+        if self.srt_limit is not None:
+            end = min(end, self.srt_limit)
+        # First search just around where the chunk is predicted to be, see SearchWindow. Only if
+        # it isn't there, search the whole window.
+        windows = [('fixed', offset, end)]
+        lo, hi = window.predict(offset, len(ptext))
+        if self.srt_limit is not None:
+            hi = min(hi, self.srt_limit)
+        if lo > offset or hi < end:
+            windows.insert(0, ('predicted', lo, hi))
+        self.fill(max(end, hi))
+        # After a few chunks in a row weren't found, the merge has probably lost its place. Then
+        # look the chunk up in the next resync_reach of the recognized text, and search there
+        # first. When streaming, that much has to be recognized first: looking it up in less
+        # could find it somewhere else than in the whole text, and the csv would come out different.
+        if window.lost >= self.resync_after:
+            reach = offset + self.resync_reach
+            self.fill(reach + search_window(ptext))
+            self.index.update(self.srt_text)
+            found = self.index.locate(ptext, offset, reach)
+            if found is not None and (self.srt_limit is None or found < self.srt_limit):
+                stop = found + search_window(ptext)
+                if self.srt_limit is not None:
+                    stop = min(stop, self.srt_limit)
+                windows.insert(0, ('index', found, stop))
+        return windows
+
+
+    def log_rejected_matches(self, rejected :list[tuple[int, int]], ptext :str) -> None:
+        """ Log the (start, end) matches of ptext that weren't good enough, if self.log_rejected """
+        if self.log_rejected:
+            for start, end in rejected:
+                startms, endms = self.to_ms_many((start, end))
+                self.log("M", startms, endms, [self.srt_text[start:end], ptext])
+
+
+    def merge_speculative(self, chunks, ahead :int, executor :Optional[ProcessPoolExecutor] = None):
+        """ Greedy merge of chunks, searching for the next ones in self.jobs processes meanwhile
+
+        Each search starts where the last match ended, so the greedy merge can't search for two
+        chunks at once. Except when a chunk isn't found: then the search for the next one starts
+        in the same place, and self.window only changes by missed(). Chunks that aren't found are
+        also the most expensive ones, searched for at every distance in every window. So after a
+        chunk isn't found, the next ahead chunks are searched for in executor, as if none of them
+        are found either. When a chunk's turn comes, write_text() uses that search if its windows
+        turned out the same, which makes it the same search, and searches again if not. So the csv
+        comes out the same as without speculating.
+
+        :param chunks: Iterable of (text, phonemes)
+        :param ahead: How many chunks to search for ahead of the merge
+        :param executor: Processes to search in, with _init_speculation() run on self.srt_text.
+            Made here, if not given.
+        """
+        own = executor is None
+        if own:
+            executor = ProcessPoolExecutor(max_workers=self.jobs, initializer=_init_speculation,
+                                           initargs=(self.srt_text,))
+        # [text, ptext, (windows, future) if searched for ahead of time]
+        pending = deque()
+        try:
+            for item in chain(chunks, repeat(None, ahead)):
+                if item is not None:
+                    pending.append([*item, None])
+                if not (len(pending) > ahead or (item is None and pending)):
+                    continue
+                text, ptext, speculation = pending.popleft()
+                guess = (speculation[0], speculation[1].result()) if speculation else None
+                self.write_text(text, ptext, guess)
+                if self.window.lost:
+                    # Not found, so speculate on the next ones not being found either
+                    window = deepcopy(self.window)
+                    for chunk in pending:
+                        if chunk[2] is None:
+                            windows = self.search_plan(chunk[1], self.srt_offset, window)
+                            chunk[2] = (windows, executor.submit(_speculate_worker, chunk[1], windows))
+                        window.missed(len(chunk[1]))
+                else:
+                    # Found, so the merge goes on from somewhere else
+                    for chunk in pending:
+                        if chunk[2] is not None:
+                            chunk[2][1].cancel()
+                            chunk[2] = None
+        finally:
+            if own:
+                executor.shutdown(cancel_futures=True)
+            else:
+                for chunk in pending:
+                    if chunk[2] is not None:
+                        chunk[2][1].cancel()
+
+
+    def finish_gap(self, last :bool):
+        """ Log the recognized text left over after the last match, up to srt_limit
+
+        Except at the very end of the book, which has never been logged.
+        """
+        if not last and self.srt_limit is not None and self.srt_offset < self.srt_limit:
+            self.log("S", self.to_ms(self.srt_offset), self.to_ms(self.srt_limit),
+                     [self.srt_text[self.srt_offset:self.srt_limit]])
+            self.srt_offset = self.srt_limit
+
+
+    def merge_anchored(self, book :list[tuple[str, str]], n :int = 4):
+        """ Merge the whole book, after first pinning it down with anchors
+
+        The greedy merge only ever looks a short way past its last match. Once that goes wrong, it
+        can lose its place for a long stretch. Here, the start of every chunk of the book whose
+        first n phoneme words occur exactly once in the book and exactly once in the recognized
+        text is taken as an anchor: that chunk starts where that text was recognized. The longest
+        chain of anchors that are in the same order in both is kept (see find_anchors()).
+
+        The anchors cut the book and the recognized text into gaps, which are merged the greedy way,
+        each on its own and never past the next anchor. Being independent, the gaps are merged by
+        self.jobs processes at once.
+
+        :param book: All chunks of the book, as (text, phonemes)
+        :param n: Number of phoneme words in an anchor
+        """
+        self.fill(sys.maxsize)
+        anchors = find_anchors([ptext for _, ptext in book], self.srt_text, self.srt_offsets, n)
+        con.print(f"Found {len(anchors)} anchors for {len(book)} chunks")
+        self.merge_gaps(book, anchors)
+
+
+    def merge_chapters(self, book :list[tuple[str, str]]):
+        """ Merge the whole book chapter by chapter
+
+        Chapter headings in the book are paired with the chapter markers spoken in the recognized
+        text (see find_chapters()), and each chapter is then merged the greedy way on its own, like
+        the gaps between anchors in merge_anchored(). Chapters are a lot fewer and longer than those
+        gaps, but they can't be mistaken even when the recognition is poor.
+
+        :param book: All chunks of the book, as (text, phonemes)
+        """
+        self.fill(sys.maxsize)
+        excluded, markers = get_language_features(self.language)
+        if not markers:
+            con.print(f"[bold yellow]WARNING:[/] No chapter markers are known for '{self.language}', "
+                      "merging the whole book as one chapter")
+            chapters = []
         else:
-            # For shorter paragraphs, only search the first couple K. (Assumes the audiobook has
-            # at most 2K worth of garbage at the front/at the begining of each chapter)
-            # String slicing doesn't get indexErrors, so we don't need to limit this.
-            end = self.srt_offset+2000
-
-        discardedmatch = False
-        for match in fuzzysearch(ptext, 
-                               self.srt_text[self.srt_offset:end],
-                               max_l_dist = len(ptext) // 4 ):
-            start = match.start + self.srt_offset
-            end = match.end + self.srt_offset
-            startms = self.to_ms(start)
-            endms = self.to_ms(end)
-            # Discard later poor matches. match.dist <= max_l_dist,
-            # so this is max 1/4 * 1K
-            if match.start < 1000 * (1 - match.dist / len(ptext)):
-                # write skipped SRT text
-                if match.start != 0:
-                    #TODO: Log the original text from the .srt file as well.
-                    self.log("S",self.to_ms(self.srt_offset), 
-                         startms,
-                         [self.srt_text[self.srt_offset:start]])
-                self.log("G",startms, endms,
-                                  [ptext, 
-                                   self.srt_text[start:end], 
-                                   text] )
+            chapters = find_chapters(book, [self.srt_word(w) for w in range(len(self.srt_words))],
+                                     self.srt_text, self.srt_offsets, markers, excluded)
+            con.print(f"Found {len(chapters)} chapters in both the book and the recognized text")
+        self.merge_gaps(book, chapters)
+
+
+    def merge_gaps(self, book :list[tuple[str, str]], anchors :list[tuple[int, int]]):
+        """ Merge the gaps between anchors, each on its own, self.jobs at once
+
+        :param book: All chunks of the book, as (text, phonemes)
+        :param anchors: (chunk, word) pairs, increasing in both: the chunk starts at the word
+        """
+        # Gaps as (first chunk, last chunk + 1, first word, last word + 1)
+        bounds = [(0, 0)] + anchors + [(len(book), len(self.srt_offsets))]
+        gaps = [(c1, c2, w1, w2) for (c1, w1), (c2, w2) in zip(bounds, bounds[1:]) if c2 > c1 or w2 > w1]
+        tasks = []
+        for i, (c1, c2, w1, w2) in enumerate(gaps):
+            # A word of context on either side, so to_ms() comes out the same as for the whole book
+            first = max(0, w1 - 1)
+            last = min(len(self.srt_offsets), w2 + 1)
+            words = [(self.srt_starts[w], self.srt_ends[w], self.srt_word(w)) for w in range(first, last)]
+            end = self.srt_offsets[last] if last < len(self.srt_offsets) else len(self.srt_text)
+            word_bounds = list(self.srt_offsets[first:last]) + [end]
+            phonemes = [self.srt_text[a:b] for a, b in zip(word_bounds, word_bounds[1:])]
+            tasks.append((words, phonemes, w1 - first, w2 - first, book[c1:c2], i == len(gaps) - 1,
+                          self.log_rejected))
+
+        executor = ProcessPoolExecutor(max_workers=self.jobs) if self.jobs > 1 else None
+        progress = build_progress("file")
+        try:
+            with progress:
+                task = progress.add_task('', total=len(tasks), verb='Merging', noun='gaps..')
+                results = executor.map(_merge_gap, tasks, chunksize=16) if executor else map(_merge_gap, tasks)
+                for records, counts, slicelist, stats in results:
+                    self.logfile.write(records)
+                    self.goodtext += counts[0]
+                    self.bookonlytext += counts[1]
+                    self.srtonlytext += counts[2]
+                    self.slicelist += slicelist
+                    for key, value in stats.items():
+                        self.stats[key] += value
+                    progress.update(task, advance=1)
+        finally:
+            if executor:
+                executor.shutdown()
+
+
+    def merge_global(self, book :list[tuple[str, str]], band :int = 500):
+        """ Merge the whole book with a single alignment, rather than chunk by chunk
+
+        The greedy merge decides on each chunk by itself, and a bad match early on can't be undone
+        later. Here the phoneme words of the whole book are aligned against the phoneme words of
+        the recognized text at once, by align_tokens(). Then each chunk is G if at least half of
+        its words are matched exactly, and runs from the first to the last recognized word it's
+        aligned with. Records are logged the same way write_text() logs them.
+
+        :param book: All chunks of the book, as (text, phonemes)
+        :param band: How far the alignment may stray from the anchors, in words, each way
+        """
+        self.fill(sys.maxsize)
+
+        tokens = []
+        chunk_starts = []
+        for _, ptext in book:
+            chunk_starts.append(len(tokens))
+            tokens += ptext.split()
+        chunk_starts.append(len(tokens))
+        srt_tokens = [(match.start(), match.end()) for match in re.finditer(r'\S+', self.srt_text)]
+        ids = {}
+        a = [ids.setdefault(token, len(ids)) for token in tokens]
+        b = [ids.setdefault(self.srt_text[start:end], len(ids)) for start, end in srt_tokens]
+
+        # Anchors make a good guide for where the band goes
+        anchors = find_anchors([ptext for _, ptext in book], self.srt_text, self.srt_offsets)
+        token_at = {start: j for j, (start, _) in enumerate(srt_tokens)}
+        guide = [(chunk_starts[chunk], token_at[self.srt_offsets[word]]) for chunk, word in anchors]
+        with con.status(f"Aligning {len(a)} words of the book with {len(b)} recognized words..."):
+            matches, equal = align_tokens(a, b, guide, band)
+
+        used = set(matches)
+        claimed = -1
+        for (text, ptext), first, last in zip(book, chunk_starts, chunk_starts[1:]):
+            aligned = [j for j in matches[first:last] if j >= 0]
+            if aligned and 2 * sum(equal[first:last]) >= last - first:
+                # espeak runs some words together in a sentence ("in the" can come out as one word)
+                # but not on their own. So if the chunk doesn't start with an exact match, it can
+                # take as many of the recognized words right before it that nothing else took
+                begin = aligned[0]
+                lead = next((k for k, same in enumerate(equal[first:last]) if same), last - first)
+                while lead > 0 and begin - 1 > claimed and begin - 1 not in used:
+                    begin -= 1
+                    lead -= 1
+                claimed = aligned[-1]
+                start = max(srt_tokens[begin][0], self.srt_offset)
+                # Up to the next word, like a fuzzy search match of the chunk's phonemes
+                end = srt_tokens[aligned[-1] + 1][0] if aligned[-1] + 1 < len(srt_tokens) else len(self.srt_text)
+                startms, endms = self.to_ms_many((start, end))
+                if start != self.srt_offset:
+                    self.log("S", self.to_ms(self.srt_offset), startms, [self.srt_text[self.srt_offset:start]])
+                self.log("G", startms, endms, [ptext, self.srt_text[start:end], text])
                 self.srt_offset = end
-                return
             else:
-                self.log("M", startms, endms, [self.srt_text[start:end], ptext] )
-        # No good matches, discard the text.
-        ms = self.to_ms(self.srt_offset)
-        self.log("B", ms, ms, [ptext, text] )
+                ms = self.to_ms(self.srt_offset)
+                self.log("B", ms, ms, [ptext, text])
+
+
+def search_window(ptext :str) -> int:
+    """How far past the last match write_text() looks for ptext, in characters of srt_text."""
+    # For longer paragraphs, only search the first bit of the book
+    # It'll match right away or not at all. (Search double the paragraph length)
+    if len(ptext) > 80:
+        return len(ptext) + len(ptext)
+    # For shorter paragraphs, only search the first couple K. (Assumes the audiobook has
+    # at most 2K worth of garbage at the front/at the begining of each chapter)
+    return 2000
+
+
+def iter_matches(ptext :str, srt_text :str, start :int, end :int, distance :int):
+    """find_matches(), a block of srt_text at a time, yielding the matches in order.
+
+    So the caller can stop at the first match it likes, without searching the rest. The blocks
+    overlap by as much as a match can be long, so each match is found in one of them whole.
+    """
+    block = max(500, len(ptext) + distance)
+    for first in range(start, end, block):
+        last = min(end, first + block + len(ptext) + distance)
+        for match in find_matches(ptext, srt_text, first, last, distance):
+            if match[0] < first + block:
+                yield match
+        if last == end:
+            break
+
+
+def match_distances(length :int) -> list[int]:
+    """Edit distances to search for a chunk of length phonemes with, in turn, see match_levels"""
+    return [length // level if level else 0 for level in match_levels]
+
+
+def match_label(level :int) -> str:
+    """Name of a level of match_levels, for the merge statistics"""
+    return f"len/{match_levels[level]}" if match_levels[level] else "exact"
+
+
+def find_matches(ptext :str, srt_text :str, start :int, end :int,
+                 distance :Optional[int] = None) -> list[tuple[int, int, int]]:
+    """Fuzzy search srt_text[start:end] for ptext.
+
+    :param distance: Edit distance allowed. Default is a quarter of ptext
+    :return: (start, end, distance) of each match, with offsets into srt_text
+    """
+    distance = len(ptext) // 4 if distance is None else distance
+    return [(match.start + start, match.end + start, match.dist)
+            for match in fuzzysearch(ptext, srt_text[start:end], max_l_dist=distance)]
+
+
+def acceptable(match :tuple[int, int, int], ptext :str, base :int) -> bool:
+    """ Whether a (start, end, distance) match of ptext, searched for from base, is good enough """
+    # Discard later poor matches. match.dist <= max_l_dist,
+    # so this is max 1/4 * 1K
+    return match[0] - base < 1000 * (1 - match[2] / len(ptext))
+
+
+def search_chunk(ptext :str, srt_text :str, windows :list[tuple[str, int, int]]) -> tuple:
+    """Search srt_text for ptext in each of windows in turn, see merge_srt.write_text()
+
+    Most chunks match (almost) exactly, and searching for those is a lot cheaper. So the allowed
+    distance only goes up, to 1/4 of the chunk, when nothing good enough was found.
+
+    :param windows: (name, start, end) of each window, see merge_srt.search_plan()
+    :return: (name, start of the window, level of match_levels, match, rejected, searches) for
+        the first acceptable match, or with Nones for all but the last two if there isn't any.
+        rejected are the (start, end) matches before it that weren't good enough, in the same
+        search, or in the last search if nothing was found. searches is the number of searches.
+    """
+    distances = match_distances(len(ptext))
+    rejected = []
+    searches = 0
+    for name, base, window in windows:
+        for level, distance in enumerate(distances):
+            if level > 0 and distance == distances[level - 1]:
+                continue
+            # Only a match starting in the first 1K can be accepted, see acceptable(). So there's
+            # no need to search further than such a match could reach.
+            stop = min(window, base + 1000 + len(ptext) + distance)
+            searches += 1
+            rejected = []
+            # Matches come in order, so the first good one is the one to take, and the rest of
+            # the window doesn't need to be searched.
+            for match in iter_matches(ptext, srt_text, base, stop, distance):
+                if acceptable(match, ptext, base):
+                    return name, base, level, match, rejected, searches
+                rejected.append(match[:2])
+    return None, None, None, None, rejected, searches
+
+
+# srt_text for _speculate_worker(), set once per process by _init_speculation()
+_speculate_text = ""
+
+
+def _init_speculation(srt_text :str) -> None:
+    global _speculate_text
+    _speculate_text = srt_text
+
+
+def _speculate_worker(ptext :str, windows :list[tuple[str, int, int]]) -> tuple:
+    """search_chunk() in the srt_text of this process, see merge_srt.merge_speculative()"""
+    return search_chunk(ptext, _speculate_text, windows)
+
+
+def align_tokens(a :list[int], b :list[int], guide :list[tuple[int, int]], band :int = 500) -> tuple[list[int], list[bool]]:
+    """Globally align two sequences of tokens, by edit distance, in a band around a guide.
+
+    A full alignment of a book is a table of (book words x recognized words) cells, far too many.
+    Only the cells within band of the guide line are computed: the line runs through (0, 0), the
+    guide points, and the two ends, and would be the diagonal without any. A row is computed at a
+    time with numpy. Insertions within a row, which depend on each other, come out of one
+    minimum.accumulate().
+
+    Only every sqrt(len(a))th row is kept. The path is traced back a stretch at a time, working
+    out the rows of that stretch again from the kept row before it. So memory stays at about
+    sqrt(len(a)) rows, for twice the time.
+
+    :param a: Book tokens, as integers
+    :param b: Recognized tokens, as integers
+    :param guide: (index in a, index in b) points the alignment should pass close to, increasing in both
+    :param band: Cells more than this many columns from the guide aren't considered
+    :return: For every token of a, the token of b it is aligned with (or -1), and whether they're equal
+    """
+
+    try:
+        import numpy as np
+    except ImportError:
+        con.print(
+            "[bold red]CRITICAL:[/] numpy library is not available, and is required for "
+            "--align global. Run [bold green]pip install numpy[/] and re-run the script."
+        )
+        sys.exit(19)
+
+    n, m = len(a), len(b)
+    if n == 0 or m == 0:
+        # Nothing to align with, e.g. no words were recognized
+        return [-1] * n, [False] * n
+    a = np.asarray(a, dtype=np.int32)
+    b = np.asarray(b, dtype=np.int32)
+    # Wide enough to get from one corner to the other, however lopsided the table is
+    width = min(m + 1, max(2 * band + 1, -(-(m + 1) // (n + 1)) + 2))
+    points = [(0, 0)] + list(guide) + [(n, m)]
+    centre = np.interp(np.arange(n + 1), [i for i, _ in points], [j for _, j in points])
+    # First column of each row's band. Never decreases, since the guide doesn't
+    lows = np.clip(np.round(centre).astype(np.int64) - band, 0, m + 1 - width).tolist()
+    # Neighbouring rows' bands have to overlap, or there's no path through them. Where the guide
+    # is steeper than that, the band follows as closely as it can
+    for i in range(1, n + 1):
+        lows[i] = min(lows[i], lows[i - 1] + width - 1)
+    lows[n] = m + 1 - width
+    for i in range(n - 1, -1, -1):
+        lows[i] = max(lows[i], lows[i + 1] - width + 1)
+    inf = np.int32(2 ** 30)
+    steps = np.arange(width, dtype=np.int32)
+
+    def next_row(i, previous):
+        # Row i from row i - 1. Cell k of a row is column lows[i] + k
+        shift = int(lows[i] - lows[i - 1])
+        up = np.full(width, inf, dtype=np.int32)
+        up[:width - shift] = previous[shift:]
+        diagonal = np.full(width, inf, dtype=np.int32)
+        if shift == 0:
+            diagonal[1:] = previous[:-1]
+        else:
+            diagonal[:width - shift + 1] = previous[shift - 1:]
+        columns = lows[i] + steps
+        cost = np.where(b[np.minimum(columns, m) - 1] == a[i - 1], 0, 1).astype(np.int32)
+        cost[columns == 0] = 1
+        diagonal[columns == 0] = inf
+        best = np.minimum(up + 1, diagonal + cost)
+        # Insertions: best[k] = min over l <= k of best[l] + (k - l)
+        return np.minimum.accumulate(best - steps) + steps
+
+    every = max(1, int(np.sqrt(n)))
+    row = np.arange(lows[0], lows[0] + width, dtype=np.int32)
+    kept = {0: row}
+    for i in range(1, n + 1):
+        row = next_row(i, row)
+        if i % every == 0:
+            kept[i] = row
+
+    matches = [-1] * n
+    equal = [False] * n
+    j = m
+    last = n
+    for top in sorted(kept, reverse=True):
+        if top >= last:
+            continue
+        rows = [kept[top]]
+        for i in range(top + 1, last + 1):
+            rows.append(next_row(i, rows[-1]))
+        for i in range(last, top, -1):
+            current = rows[i - top]
+            previous = rows[i - top - 1]
+            while True:
+                k = j - lows[i]
+                value = current[k]
+                if j > 0 and 0 <= j - 1 - lows[i - 1] < width:
+                    same = a[i - 1] == b[j - 1]
+                    if value == previous[j - 1 - lows[i - 1]] + (0 if same else 1):
+                        matches[i - 1] = j - 1
+                        equal[i - 1] = bool(same)
+                        j -= 1
+                        break
+                if 0 <= j - lows[i - 1] < width and value == previous[j - lows[i - 1]] + 1:
+                    break
+                # Recognized token skipped
+                j -= 1
+        last = top
+
+    return matches, equal
+
+
+def find_anchors(book :list[str], srt_text :str, srt_offsets, n :int = 4) -> list[tuple[int, int]]:
+    """Find the chunks of the book whose start can be pinned to a word of the recognized text.
+
+    A chunk is an anchor if the n phoneme words it starts with occur exactly once in the whole
+    book, exactly once in srt_text, and that one place in srt_text is the start of a recognized
+    word. Of those, the longest chain that runs forward in both (longest increasing subsequence)
+    is returned, so no anchor contradicts another.
+
+    :param book: Phonemes of every chunk of the book, in order
+    :param srt_text: Phonemes of the recognized words
+    :param srt_offsets: Offset in srt_text of each recognized word
+    :param n: Number of phoneme words in an anchor
+    :return: List of (chunk, word) pairs, increasing in both
+    """
 
+    def ngrams(tokens):
+        counts = {}
+        for i in range(len(tokens) - n + 1):
+            key = ' '.join(tokens[i:i + n])
+            counts[key] = i if key not in counts else -1
+        return counts
+
+    tokens = []
+    starts = []
+    for ptext in book:
+        starts.append(len(tokens))
+        tokens += ptext.split()
+    book_grams = ngrams(tokens)
+
+    srt_tokens = [(match.start(), match.group()) for match in re.finditer(r'\S+', srt_text)]
+    srt_grams = ngrams([token for _, token in srt_tokens])
+    word_at = {offset: i for i, offset in enumerate(srt_offsets)}
+
+    candidates = []
+    for chunk, start in enumerate(starts):
+        key = ' '.join(tokens[start:start + n])
+        if len(tokens) - start < n or book_grams.get(key) != start:
+            continue
+        if (position := srt_grams.get(key, -1)) < 0:
+            continue
+        if (word := word_at.get(srt_tokens[position][0])) is not None:
+            candidates.append((chunk, word))
+
+    return longest_chain(candidates)
+
+
+def longest_chain(candidates :list[tuple[int, int]]) -> list[tuple[int, int]]:
+    """Longest chain of (chunk, word) pairs, sorted by chunk, that is increasing in word too.
+
+    :param candidates: (chunk, word) pairs, with increasing chunks
+    :return: The longest increasing subsequence of candidates, by word
+    """
+    tails = []
+    links = [-1] * len(candidates)
+    ends = []
+    for i, (_, word) in enumerate(candidates):
+        j = bisect_right(tails, word - 1)
+        if j == len(tails):
+            tails.append(word)
+            ends.append(i)
+        else:
+            tails[j] = word
+            ends[j] = i
+        links[i] = ends[j - 1] if j > 0 else -1
+    chain = []
+    i = ends[-1] if ends else -1
+    while i >= 0:
+        chain.append(candidates[i])
+        i = links[i]
+
+    return chain[::-1]
+
+
+# Per process espeak backend for _merge_gap(). Only used for the phoneme cache key: the words
+# of a gap come already phonemized
+_merge_espeak = None
+
+
+def find_chapters(book :list[tuple[str, str]], srt_words :list[str], srt_text :str, srt_offsets,
+                  markers :tuple, excluded :tuple = ()) -> list[tuple[int, int]]:
+    """Pair the chapter headings of the book with the chapter markers in the recognized text.
+
+    A heading is a short chunk that starts with one of the markers ("Chapter Three"), a spoken
+    marker is a recognized marker word that isn't part of one of the excluded phrases ("in
+    chapter"). They are paired by their phonemes, the marker and what follows, which is the same
+    for "Chapter 3" and "chapter three". Like find_anchors(), only headings that occur once in
+    each are used, and of those the longest chain that runs forward in both.
+
+    :param book: All chunks of the book, as (text, phonemes)
+    :param srt_words: The recognized words
+    :param srt_text: Phonemes of the recognized words
+    :param srt_offsets: Offset in srt_text of each recognized word
+    :param markers: Words that start a chapter heading, lowercase
+    :param excluded: Phrases where a marker doesn't start a chapter, lowercase
+    :return: List of (chunk, word) pairs, increasing in both
+    """
 
+    def is_excluded(phrase):
+        return any(phrase.startswith(e) for e in excluded)
+
+    headings = {}
+    for chunk, (text, ptext) in enumerate(book):
+        words = re.findall(r"[\w']+", text.lower())
+        if not words or words[0] not in markers or len(words) > 8 or is_excluded(' '.join(words)):
+            continue
+        key = ' '.join(ptext.split()[:3])
+        headings[key] = chunk if key not in headings else -1
+
+    spoken = {}
+    for word, recognized in enumerate(srt_words):
+        if recognized not in markers:
+            continue
+        before = srt_words[word - 1] + ' ' if word > 0 else ''
+        after = ' ' + srt_words[word + 1] if word + 1 < len(srt_words) else ''
+        if is_excluded(before + recognized) or is_excluded(recognized + after):
+            continue
+        following = srt_text[srt_offsets[word]:srt_offsets[word] + 200].split()
+        for size in range(1, 4):
+            if headings.get(key := ' '.join(following[:size]), -1) >= 0:
+                spoken[key] = word if key not in spoken else -1
+
+    candidates = sorted((chunk, spoken[key]) for key, chunk in headings.items()
+                        if chunk >= 0 and spoken.get(key, -1) >= 0)
+    return longest_chain(candidates)
+
+
+def _merge_gap(task) -> tuple[str, tuple[int, int, int], list[dict], dict]:
+    """Greedy merge of one gap between anchors, see merge_srt.merge_gaps()
+
+    :param task: (words, their phonemes, first word of the gap, last word + 1, chunks, is last gap,
+                  whether to log rejected matches)
+    :return: The csv records, (good, book only, srt only) counts, the slicelist and the statistics
+    """
+    global _merge_espeak
+    words, phonemes, first, last, chunks, is_last, log_rejected = task
+    _merge_espeak = _merge_espeak or EspeakBackend('en-us')
+    logfile = io.StringIO()
+    merge = merge_srt.from_words([], _merge_espeak, logfile)
+    merge.add_words(words, phonemes)
+    merge.log_rejected = log_rejected
+    merge.srt_offset = merge.srt_offsets[first] if first < len(words) else len(merge.srt_text)
+    if last < len(words):
+        merge.srt_limit = merge.srt_offsets[last]
+    for chunk, ptext in chunks:
+        merge.write_text(chunk, ptext)
+    merge.finish_gap(is_last)
+    return (logfile.getvalue(), (merge.goodtext, merge.bookonlytext, merge.srtonlytext), merge.slicelist,
+            merge.stats)
+
+
+
+def repair_csv(audiobook_path: PathLike, csv_path: PathLike, language: str, model_type: str,
+               espeak: Optional[EspeakBackend] = None, pcm_cache: Optional[PcmCache] = None,
+               pool: Optional[RecognizerPool] = None, phonemes: Optional[PhonemeCache] = None) -> list[dict]:
+    """Recognize the parts of the book that didn't merge over again, and merge just those again.
+
+    A gap is a run of csv records between two G records, with some ebook text (B records) that
+    didn't match anything. The audio between the two G records is where that text has to be, so
+    only that is recognized again: with the model_type model, and restricted to the words of the
+    missing text if the model can be. The missing text is then merged against the new words. If
+    anything matches, the gap's records are replaced by the new ones.
+
+    The csv is rewritten in place (under a temporary name, then renamed), and comment lines are
+    kept with their records, so it can still be hand edited afterwards.
+
+    :param audiobook_path: Path to the audiobook file
+    :param csv_path: Path to the csv slicing file
+    :param language: Model language
+    :param model_type: The type of model to recognize gaps with (large or small)
+    :param espeak: Already initialized espeak backend, if any
+    :param pcm_cache: PcmCache to read the audio from, instead of decoding it with ffmpeg
+    :param pool: RecognizerPool to use, if it has the right model loaded
+    :param phonemes: PhonemeCache for the recognized words, if any
+    :return: List of the G records in the new csv, like merge_srt.slicelist
+    """
 
-def verify_count(audiobook_path: PathLike, expected :int) -> None:
+    # Records with the comment lines in front of them: [lines, type, start, stop, text]
+    records = []
+    comments = []
+    with open(csv_path, 'r') as fp:
+        for line in fp:
+            if line.startswith('#'):
+                comments.append(line)
+                continue
+            logtype, start, stop, text = line.rstrip('\n').split('|', 3)
+            records.append([comments + [line], logtype, int(start), int(stop), text])
+            comments = []
+
+    gaps = []
+    i = 0
+    while i < len(records):
+        if records[i][1] == 'G':
+            i += 1
+            continue
+        first = i
+        while i < len(records) and records[i][1] != 'G':
+            i += 1
+        start = records[first - 1][3] if first > 0 else 0
+        end = records[i][2] if i < len(records) else get_duration_ms(audiobook_path, pcm_cache)
+        if any(record[1] == 'B' for record in records[first:i]) and end - start > 200:
+            gaps.append((first, i, start, end))
+    if not gaps:
+        con.print("[bold green]SUCCESS![/] Nothing to repair")
+        return [{'start': r[2], 'end': r[3], 'text': r[4]} for r in records if r[1] == 'G']
+
+    model_path = find_model(language, model_type)
+    if pool and pool.model_path == model_path:
+        model = pool.model
+    else:
+        model = load_model(model_path, language)
+    espeak = espeak or EspeakBackend('en-us')
+    length = sum(end - start for _, _, start, end in gaps)
+    con.print(f"Repairing {len(gaps)} gaps, {length / 1000:.1f}s of audio")
+
+    repaired = 0
+    matched = 0
+    progress = build_progress(bar_type='file')
+    with progress:
+        task = progress.add_task('', total=len(gaps), verb='Repairing', noun='gaps...')
+        # From the end, so the indexes of the gaps still to go don't move
+        for first, last, start, end in reversed(gaps):
+            chunks = [record[4] for record in records[first:last] if record[1] == 'B']
+            grammar = build_grammar(' '.join(chunks)) if supports_grammar(model_path) else None
+            words = recognize_segment(model, audiobook_path, start, end, pcm_cache=pcm_cache, grammar=grammar)
+            if not words:
+                # Silence, music, or nothing the grammar allows: nothing to merge against
+                progress.update(task, advance=1)
+                continue
+            logfile = io.StringIO()
+            merge = merge_srt.from_words(words, espeak, logfile, phonemes)
+            for chunk in chunks:
+                merge.write_text(chunk)
+            if merge.goodtext > 0:
+                lines = logfile.getvalue().splitlines(keepends=True)
+                replacement = []
+                comments = []
+                for line in lines:
+                    if line.startswith('#'):
+                        comments.append(line)
+                        continue
+                    logtype, rstart, rstop, text = line.rstrip('\n').split('|', 3)
+                    replacement.append([comments + [line], logtype, int(rstart), int(rstop), text])
+                    comments = []
+                records[first:last] = replacement
+                repaired += 1
+                matched += merge.goodtext
+            progress.update(task, advance=1)
+
+    temp = Path(f"{csv_path}.tmp")
+    with open(temp, 'w') as fp:
+        for record in records:
+            fp.writelines(record[0])
+    os.replace(temp, csv_path)
+    con.print(f"[bold green]SUCCESS![/] Repaired {repaired} of {len(gaps)} gaps, {matched} more fragments matched")
+
+    return [{'start': r[2], 'end': r[3], 'text': r[4]} for r in records if r[1] == 'G']
+
+
+def verify_count(audiobook_path: PathLike, expected :int, suffix: str = '.mp3') -> None:
     """Verify that the expected number of files were generated.
 
     Compares the number of files split from the audiobook to ensure it matches the length of the generated
@@ -982,10 +3454,11 @@ def verify_count(audiobook_path: PathLike, expected :int) -> None:
 
     :param audiobook_path: Path to audiobook file
     :param timecodes: List of dictionaries containing chapter type, start, and end times
+    :param suffix: File type the audiobook was split into
     :return: None (void)
     """
 
-    file_count = sum(1 for x in audiobook_path.parent.glob('*.mp3') if x.stem != audiobook_path.stem)
+    file_count = sum(1 for x in audiobook_path.parent.glob(f'*{suffix}') if x.stem != audiobook_path.stem)
     if file_count >= expected:
         con.print(f"[bold green]SUCCESS![/] Audiobook split into {file_count} files\n")
     else:
@@ -995,6 +3468,314 @@ def verify_count(audiobook_path: PathLike, expected :int) -> None:
         )
 
 
+def process_book(audiobook_file: Path, text_file: Path, words_file: Path, srt_file: Path, csv_file: Path,
+                 stopme: Optional[str], lang: str, model_type: str, options: dict,
+                 pool: Optional[RecognizerPool] = None, espeak: Optional[EspeakBackend] = None,
+                 phonemes: Optional[PhonemeCache] = None) -> None:
+    """Run an audiobook through recognition, merging and splitting.
+
+    :param audiobook_file: Path to the audiobook file
+    :param text_file: Path to the ebook text file
+    :param words_file: Path to the word timing file
+    :param srt_file: Path to the srt timecode file
+    :param csv_file: Path to the csv slicing file
+    :param stopme: Stage ('srt' or 'csv') to stop after, or None to split the file
+    :param lang: Model language
+    :param model_type: The type of model (large or small)
+    :param options: Tuning options from parse_args()
+    :param pool: RecognizerPool with an already loaded model, if any
+    :param espeak: Already initialized espeak backend, if any
+    :param phonemes: PhonemeCache to use. By default, one is opened if options has a path for it
+    :return: None
+    """
+
+    if phonemes is None and options['phoneme_cache']:
+        phonemes = PhonemeCache(options['phoneme_cache'])
+    pcm_cache = None
+    if options['pcm_cache']:
+        pcm_cache = PcmCache(audiobook_file, None if options['pcm_cache'] is True else options['pcm_cache'])
+
+    recognition = {
+        'jobs': options['jobs'], 'threads': options['threads'], 'pool': pool, 'srt_file': srt_file,
+        'export_srt': options['export_srt'], 'vad': options['vad'], 'pcm_cache': pcm_cache,
+        'grammar': build_grammar(Path(text_file).read_text()) if options['grammar'] else None,
+        'two_pass': options['two_pass']
+    }
+
+    if options['stream'] and stopme != 'srt' and not find_timings(words_file, srt_file):
+        # Recognize in the background, and merge the words as they come in
+        con.rule("[cyan]Using Vosk to Generate timecodes, and merging them as they come[/cyan]")
+        stream = WordStream()
+        stream.start(generate_timecodes, audiobook_file, words_file, lang, model_type, **recognition)
+        try:
+            slicelist = merge_srt(words_file, text_file, csv_file, espeak=espeak, stream=stream,
+                                  phonemes=phonemes, align=options['align'],
+                                  jobs=max(options['jobs'], options['threads']), language=lang,
+                                  log_rejected=options['log_rejected']).slicelist
+        except BaseException:
+            stream.cancel()
+            raise
+        stream.join()
+    else:
+        # Generate timecodes from mp3 file
+        con.rule("[cyan]Using Vosk to Generate timecodes[/cyan]")
+        timing_file = generate_timecodes(audiobook_file, words_file, lang, model_type, **recognition)
+
+        if stopme == 'srt':
+            return
+
+        # merge correct text from ebook file against srt file to generate slicelist
+        slicelist = merge_srt(timing_file, text_file, csv_file, espeak=espeak, phonemes=phonemes,
+                              align=options['align'], jobs=max(options['jobs'], options['threads']),
+                              language=lang, speculate=options['speculate'],
+                              log_rejected=options['log_rejected']).slicelist
+
+    if options['repair']:
+        con.rule("[cyan]Repairing unmatched text[/cyan]")
+        slicelist = repair_csv(audiobook_file, csv_file, lang, options['repair'], espeak=espeak,
+                               pcm_cache=pcm_cache, pool=pool, phonemes=phonemes)
+
+    if stopme == 'csv':
+        return
+
+    # Split the file
+    con.rule("[cyan]Splitting File[/cyan]")
+    wav = (pcm_cache or PcmCache(audiobook_file)) if options['wav'] else None
+    expected = split_file(audiobook_file, slicelist, wav)
+
+    # Count the generated files and compare to timecode dict to ensure they match
+    verify_count(audiobook_file, expected, '.wav' if wav else '.mp3')
+
+
+def build_lexicon(library: Path, phonemes: PhonemeCache, jobs: int = 1, batch: int = 1000) -> None:
+    """Phonemize every word of a library of books ahead of time.
+
+    Collects the words of every ebook (.txt), srt file and word timing file (.words) under
+    library, and the chunks merge_srt splits the ebooks into, and adds the ones the phoneme
+    cache doesn't have yet. Merging those books later then only needs to look them up. The
+    chunks are kept whole, rather than looked up a word at a time, since espeak runs words
+    together within a sentence. Everything is phonemized in batches, by jobs threads, each with
+    its own espeak.
+
+    :param library: Directory to look for books in
+    :param phonemes: The PhonemeCache to fill
+    :param jobs: Number of espeak instances to run at once
+    :param batch: Words or chunks per espeak call
+    :return: None
+    """
+
+    words = set()
+    chunks = set()
+    files = 0
+    with con.status("Collecting words..."):
+        for path in library.rglob('*'):
+            try:
+                if path.suffix == '.txt':
+                    text = path.read_text()
+                    words |= book_words(text)
+                    # The same way merge_srt.phonemize_text() splits it
+                    for line in text.splitlines():
+                        chunks.update(merge_srt.quotesplit(dumbquote(line.rstrip())))
+                elif path.suffix == '.srt':
+                    # Every record is a counter, a timestamp, the word, and a blank line
+                    words.update(record.split('\n')[2] for record in path.read_text().split('\n\n')
+                                 if record.count('\n') >= 2)
+                elif path.suffix == '.words':
+                    with WordTimings(path) as timings:
+                        words.update(timings.table)
+                else:
+                    continue
+            except (OSError, UnicodeDecodeError, ValueError) as e:
+                con.print(f"[bold yellow]WARNING:[/] Skipping {path}: {e}")
+                continue
+            files += 1
+
+    key = PhonemeCache.key(EspeakBackend('en-us'))
+    texts = sorted(words | chunks)
+    known = phonemes.get_many(key, texts)
+    missing = [text for text in texts if text not in known]
+    con.print(f"Found {len(words)} distinct words and {len(chunks)} distinct chunks in {files} files, "
+              f"{len(missing)} not in the lexicon yet")
+
+    backends = local()
+
+    def phonemize(chunk: list[str]) -> dict[str, str]:
+        if not hasattr(backends, 'espeak'):
+            backends.espeak = EspeakBackend('en-us')
+        return dict(zip(chunk, phonemize_batch(backends.espeak, chunk)))
+
+    progress = build_progress(bar_type='file')
+    with progress, ThreadPoolExecutor(max_workers=jobs) as executor:
+        task = progress.add_task('', total=len(missing), verb='Phonemizing', noun='words..')
+        futures = [executor.submit(phonemize, missing[i:i + batch]) for i in range(0, len(missing), batch)]
+        for future in as_completed(futures):
+            result = future.result()
+            phonemes.put_many(key, result)
+            progress.update(task, advance=len(result))
+
+    con.print(f"[bold green]SUCCESS![/] Lexicon {phonemes.path} has every word and chunk of the library")
+
+
+def submit_job(spool: Path, audiobook_file: Path, text_file: Path, words_file: Path, srt_file: Path,
+               csv_file: Path, stopme: Optional[str], lang: str, model_type: str, options: dict) -> int:
+    """Queue an audiobook for a worker started with --serve, and wait for it to finish.
+
+    Jobs are json files in the spool directory. They are written under a temporary name and
+    renamed into place, so a worker never sees half a job. Workers touch their files every
+    heartbeat_seconds, see serve(). If no worker has been heard from for options['timeout']
+    seconds while the job waits, or the one working on it hasn't, this gives up.
+
+    :param spool: The worker's spool directory
+    :param options: Tuning options from parse_args(). The job_options of them go with the job
+    :return: Exit status of the job
+    """
+
+    spool.mkdir(parents=True, exist_ok=True)
+    name = f"{time.time_ns()}-{os.getpid()}"
+    request = {
+        'audiobook': str(audiobook_file.resolve()),
+        'textfile': str(text_file.resolve()),
+        'wordsfile': str(words_file.resolve()),
+        'srtfile': str(srt_file.resolve()),
+        'csvfile': str(csv_file.resolve()),
+        'stop': stopme,
+        'language': lang,
+        'model_type': model_type,
+        'options': {key: options[key] for key in job_options}
+    }
+    # The worker runs somewhere else
+    if isinstance(request['options']['pcm_cache'], str):
+        request['options']['pcm_cache'] = str(Path(request['options']['pcm_cache']).resolve())
+    temp = spool / f"{name}.tmp"
+    queued = spool / f"{name}.job"
+    running = spool / f"{name}.running"
+    temp.write_text(json.dumps(request))
+    temp.rename(queued)
+    con.print(f"Queued [blue]{audiobook_file.name}[/] as job {name}, waiting for a worker...")
+    timeout = options['timeout']
+    submitted = time.time()
+
+    def heard_from(path: Path) -> bool:
+        try:
+            return time.time() - path.stat().st_mtime <= timeout
+        except FileNotFoundError:
+            return False
+
+    while True:
+        for suffix in ('.done', '.failed'):
+            if (result := spool / f"{name}{suffix}").exists():
+                status = json.loads(result.read_text())['status']
+                result.unlink()
+                if status == 0:
+                    con.print(f"[bold green]SUCCESS![/] Worker finished {audiobook_file.name}")
+                else:
+                    con.print(f"[bold red]ERROR:[/] Worker failed {audiobook_file.name} with status {status}")
+                return status
+        if running.exists() and not heard_from(running):
+            running.unlink(missing_ok=True)
+            con.print(f"[bold red]ERROR:[/] The worker on job {name} hasn't been heard from for {timeout} "
+                      "seconds, and probably died")
+            return 1
+        if (queued.exists() and time.time() - submitted > timeout
+                and not any(heard_from(alive) for alive in spool.glob('*.alive'))):
+            try:
+                queued.unlink()
+            except FileNotFoundError:
+                # A worker took it just now
+                continue
+            con.print(f"[bold red]ERROR:[/] No worker watching {spool} has been heard from for {timeout} "
+                      "seconds. Start one with --serve")
+            return 1
+        time.sleep(1)
+
+
+def heartbeat(paths: list[Path], stopping: Event) -> None:
+    """Touch each of paths every heartbeat_seconds until stopping is set, see serve()
+
+    Takes no locks but its own, so the worker forking processes while this runs is safe.
+
+    :param paths: Files to touch. May change while this runs. Files that are gone are skipped
+    :param stopping: Set to stop
+    :return: None
+    """
+
+    while not stopping.wait(heartbeat_seconds):
+        for path in list(paths):
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+
+
+def serve(spool: Path, options: dict) -> None:
+    """Process jobs queued by submit_job() until interrupted.
+
+    Loaded models and espeak backends are kept between jobs, so after the first book only the
+    actual work is left. Jobs are claimed by renaming them, which is atomic, so several workers
+    can share a spool directory. A heartbeat thread touches worker-<pid>.alive, and the job being
+    worked on, every heartbeat_seconds, so submit_job() can tell the worker hasn't died.
+
+    :param spool: Directory to take jobs from
+    :param options: Tuning options from parse_args(). A job's own job_options take their place
+    :return: None
+    """
+
+    spool.mkdir(parents=True, exist_ok=True)
+    pools = {}
+    backends = {}
+    phonemes = PhonemeCache(options['phoneme_cache']) if options['phoneme_cache'] else None
+    alive = spool / f"worker-{os.getpid()}.alive"
+    alive.touch()
+    beating = [alive]
+    stopping = Event()
+    Thread(target=heartbeat, args=(beating, stopping), name='heartbeat', daemon=True).start()
+    con.print(f"Worker waiting for jobs in [blue]{spool}[/]")
+
+    try:
+        while True:
+            if not (jobs := sorted(spool.glob('*.job'))):
+                time.sleep(1)
+                continue
+            running = jobs[0].with_suffix('.running')
+            try:
+                jobs[0].rename(running)
+            except OSError:
+                # Another worker got there first
+                continue
+            beating.append(running)
+
+            request = json.loads(running.read_text())
+            con.rule(f"[cyan]Job {running.stem}: {Path(request['audiobook']).name}[/cyan]")
+            key = (request['language'], request['model_type'])
+            job = {**options, **request.get('options', {})}
+            try:
+                if key not in pools:
+                    pools[key] = RecognizerPool(find_model(*key), request['language'], options['threads'])
+                if 'en-us' not in backends:
+                    backends['en-us'] = EspeakBackend('en-us')
+                process_book(Path(request['audiobook']), Path(request['textfile']), Path(request['wordsfile']),
+                             Path(request['srtfile']), Path(request['csvfile']), request['stop'],
+                             request['language'], request['model_type'], job, pools[key],
+                             backends['en-us'], phonemes)
+                status = 0
+            except SystemExit as e:
+                status = e.code if isinstance(e.code, int) else 1
+            except Exception as e:
+                con.print(f"[bold red]ERROR:[/] Job failed: [red]{e}[/red]\n")
+                status = 1
+
+            running.write_text(json.dumps({**request, 'status': status}))
+            running.rename(running.with_suffix('.done' if status == 0 else '.failed'))
+            beating.remove(running)
+    except KeyboardInterrupt:
+        con.print("Worker stopped")
+    finally:
+        stopping.set()
+        alive.unlink(missing_ok=True)
+        for pool in pools.values():
+            pool.close()
+
+
 def main():
     """
     Main driver function.
@@ -1011,10 +3792,8 @@ def main():
         sys.exit(20)
 
     # Destructure tuple
-    audiobook_file, text_file, srt_file, csv_file, stopme, lang, model_name, model_type = parse_args()
-    if not str(audiobook_file).endswith('.mp3'):
-        con.print("[bold red]ERROR:[/] The script only works with .mp3 files (for now)")
-        sys.exit(9)
+    (audiobook_file, text_file, words_file, srt_file, csv_file,
+     stopme, lang, model_name, model_type, options) = parse_args()
 
     # Download model if option selected
     if model_name and lang:
@@ -1022,25 +3801,27 @@ def main():
         con.print("[magenta]Preparing download...[/magenta]")
         download_model(model_name)
 
-    # Generate timecodes from mp3 file
-    con.rule("[cyan]Using Vosk to Generate timecodes as .srt[/cyan]")
-    srt_file = generate_timecodes(audiobook_file, srt_file, lang, model_type)
-
-    if stopme == 'srt':
-        sys.exit(0)
+    if options['serve']:
+        serve(options['serve'], options)
+        return
 
-    # merge correct text from ebook file against srt file to generate slicelist
-    slicelist = merge_srt(srt_file, text_file, csv_file).slicelist
+    if options['build_lexicon']:
+        if not options['phoneme_cache']:
+            con.print("[bold red]ERROR:[/] --build-lexicon fills the phoneme cache, and can't be used with --no-phoneme-cache")
+            sys.exit(1)
+        con.rule("[cyan]Building lexicon[/cyan]")
+        build_lexicon(options['build_lexicon'], PhonemeCache(options['phoneme_cache']), options['jobs'])
+        return
 
-    if stopme == 'csv':
-        sys.exit(0)
+    if not str(audiobook_file).endswith('.mp3'):
+        con.print("[bold red]ERROR:[/] The script only works with .mp3 files (for now)")
+        sys.exit(9)
 
-    # Split the file
-    con.rule("[cyan]Splitting File[/cyan]")
-    expected = split_file(audiobook_file, slicelist)
+    if options['spool']:
+        sys.exit(submit_job(options['spool'], audiobook_file, text_file, words_file, srt_file, csv_file,
+                            stopme, lang, model_type, options))
 
-    # Count the generated files and compare to timecode dict to ensure they match
-    verify_count(audiobook_file, expected)
+    process_book(audiobook_file, text_file, words_file, srt_file, csv_file, stopme, lang, model_type, options)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""Check that merging with --speculate gives the same csv as the serial greedy merge.
+
+Makes up a book of random sentences, and recognized words for it with some words dropped,
+changed or added, and a bit of junk between some sentences. Then merges it the greedy way,
+once chunk by chunk and once with merge_srt.merge_speculative(), and compares the records.
+
+The speculative searches only make the merge faster with spare cores to run them on. The cpu
+time of the merge's own process shows how much of the searching was moved off it.
+
+usage: python benchmarks/speculate_check.py [CHUNKS] [AHEAD] [JOBS]
+"""
+
+import importlib.util
+import io
+import random
+import sys
+import time
+from pathlib import Path
+
+root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(root))
+spec = importlib.util.spec_from_file_location('audiobook', root / 'audiobook-to-AI-Training-data.py')
+audiobook = importlib.util.module_from_spec(spec)
+# Registered, so the speculative searches can be handed to worker processes
+sys.modules['audiobook'] = audiobook
+spec.loader.exec_module(audiobook)
+
+
+def synthetic_book(chunks: int) -> tuple[list[str], list[tuple[int, int, str]]]:
+    """Random sentences, and noisy recognized words for them, 300ms long with 100ms between them"""
+    rng = random.Random(1)
+    vocabulary = [''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(2, 9)))
+                  for _ in range(2000)]
+    sentences = [' '.join(rng.choices(vocabulary, k=rng.randint(3, 40))) + '.' for _ in range(chunks)]
+    spoken = []
+    for sentence in sentences:
+        if rng.random() < 0.15:
+            spoken += rng.choices(vocabulary, k=rng.randint(1, 30))
+        for word in sentence.rstrip('.').split():
+            roll = rng.random()
+            if roll < 0.08:
+                continue
+            spoken.append(rng.choice(vocabulary) if roll < 0.2 else word)
+            if roll > 0.95:
+                spoken.append(rng.choice(vocabulary))
+    return sentences, [(i * 400, i * 400 + 300, word) for i, word in enumerate(spoken)]
+
+
+def merge(espeak, words, book, ahead: int = 0, jobs: int = 1) -> tuple[str, float, float, dict]:
+    """Greedy merge of book against words
+
+    :return: The csv records, the time it took, the cpu time this process took (not counting the
+        speculative searches, which are done in other processes), and the merge statistics
+    """
+    logfile = io.StringIO()
+    merger = audiobook.merge_srt.from_words([], espeak, logfile)
+    merger.add_words(words)
+    merger.jobs = jobs
+    began, began_cpu = time.perf_counter(), time.process_time()
+    if ahead:
+        merger.merge_speculative(iter(book), ahead)
+    else:
+        for text, ptext in book:
+            merger.write_text(text, ptext)
+    return logfile.getvalue(), time.perf_counter() - began, time.process_time() - began_cpu, merger.stats
+
+
+def main():
+    chunks = int(sys.argv[1]) if len(sys.argv) > 1 else 48
+    ahead = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    jobs = int(sys.argv[3]) if len(sys.argv) > 3 else 2
+    sentences, words = synthetic_book(chunks)
+    espeak = audiobook.EspeakBackend('en-us')
+    book = list(zip(sentences, audiobook.phonemize_batch(espeak, sentences)))
+
+    serial, *serial_times = merge(espeak, words, book)
+    speculative, *speculative_times = merge(espeak, words, book, ahead, jobs)
+    for name, records, seconds, cpu, stats in (('serial', serial, *serial_times),
+                                               ('speculative', speculative, *speculative_times)):
+        counts = ', '.join(f"{records.count(chr(10) + kind + '|') + records.startswith(kind + '|')} {kind}"
+                           for kind in 'GBS')
+        print(f"{name:12} {counts}, {seconds:.1f}s, {cpu:.1f}s cpu in the merge's own process, "
+              f"{stats['speculated']} of {stats['searches']} searches done ahead of time")
+    if serial != speculative:
+        first = next(i for i, (a, b) in enumerate(zip(serial.splitlines(), speculative.splitlines())) if a != b)
+        print(f"DIFFERENT, from csv line {first + 1}")
+        sys.exit(1)
+    print("same")
+
+
+if __name__ == '__main__':
+    main()
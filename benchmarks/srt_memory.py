@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Memory used by merge_srt to hold the recognized words of a book.
+
+Writes a synthetic one-word-per-record srt file (400,000 words by default, about a 40 hour
+book), reads it with merge_srt.read_srt(), and compares the memory that is kept afterwards
+with the lists of tuples and strings merge_srt used before.
+
+usage: python benchmarks/srt_memory.py [WORDS] [DISTINCT_WORDS]
+"""
+
+import importlib.util
+import random
+import sys
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(root))
+spec = importlib.util.spec_from_file_location('audiobook', root / 'audiobook-to-AI-Training-data.py')
+audiobook = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(audiobook)
+
+
+def synthetic_words(count: int, distinct: int) -> list[tuple[int, int, str]]:
+    """Random words with a roughly natural (Zipf) frequency, 300ms long with 100ms between them"""
+    rng = random.Random(1)
+    vocabulary = [''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(2, 10)))
+                  for _ in range(distinct)]
+    weights = [1 / (rank + 1) for rank in range(distinct)]
+    return [(i * 400, i * 400 + 300, word) for i, word in enumerate(rng.choices(vocabulary, weights, k=count))]
+
+
+def legacy(words: list[tuple[int, int, str]], phonemes: dict[str, str]) -> tuple:
+    """The structures merge_srt.read_srt() used to build, one word at a time, before add_words()"""
+    srt_text = ""
+    srt_offsets = []
+    srt_times = []
+    srt_gtext = []
+    for start, stop, word in words:
+        srt_times += [(start, stop)]
+        srt_offsets += [len(srt_text)]
+        srt_gtext += [word]
+        srt_text += phonemes[word]
+    return srt_text, srt_offsets, srt_times, srt_gtext
+
+
+def measure(build) -> tuple[object, int, int]:
+    """Run build(), returning its result, and the memory it kept and peaked at"""
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current - before, peak - before
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 400000
+    distinct = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    words = synthetic_words(count, distinct)
+
+    espeak = audiobook.EspeakBackend('en-us')
+    unique = list(dict.fromkeys(word for _, _, word in words))
+    phonemes = dict(zip(unique, audiobook.phonemize_batch(espeak, unique)))
+
+    with tempfile.TemporaryDirectory() as temp:
+        srt_path = Path(temp) / 'synthetic.srt'
+        audiobook.write_srt([{'start': start, 'end': stop, 'word': word} for start, stop, word in words], srt_path)
+        print(f"{count} words ({len(unique)} distinct), {srt_path.stat().st_size / 2**20:.1f} MB of srt")
+
+        old, old_kept, old_peak = measure(lambda: legacy(words, phonemes))
+        merge = audiobook.merge_srt.from_words([], espeak, None)
+        # Phonemize up front, so only the word storage is measured
+        merge.phonemize_many = lambda texts, show_progress=False: [phonemes[text] for text in texts]
+        _, new_kept, new_peak = measure(lambda: merge.read_srt(srt_path))
+
+    assert merge.srt_text == old[0] and list(merge.srt_offsets) == old[1]
+    print(f"{'':10} {'kept':>10} {'peak':>10}")
+    print(f"{'lists':10} {old_kept / 2**20:9.1f}M {old_peak / 2**20:9.1f}M")
+    print(f"{'arrays':10} {new_kept / 2**20:9.1f}M {new_peak / 2**20:9.1f}M")
+    print(f"kept {old_kept / new_kept:.1f}x less")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""Check that merging with --stream gives the same csv as merging the whole recognized text.
+
+Makes up a book of random sentences, and recognized words for it with a few sentences skipped
+and two long stretches of words the book doesn't have. So the merge loses its place, and has to
+find it again through the phoneme index. Then merges it once with all the words there from the
+start, and once taking them a word at a time, the way merge_srt.fill() takes them from
+recognition, and compares the records.
+
+usage: python benchmarks/stream_check.py [SEED]
+"""
+
+import importlib.util
+import io
+import random
+import sys
+from pathlib import Path
+
+root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(root))
+spec = importlib.util.spec_from_file_location('audiobook', root / 'audiobook-to-AI-Training-data.py')
+audiobook = importlib.util.module_from_spec(spec)
+sys.modules['audiobook'] = audiobook
+spec.loader.exec_module(audiobook)
+
+
+def synthetic_book(seed: int) -> tuple[list[str], list[tuple[int, int, str]]]:
+    """60 random sentences, and the words recognized for them, 300ms long with 100ms between them"""
+    rng = random.Random(seed)
+    vocabulary = [''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(2, 8)))
+                  for _ in range(3000)]
+    sentences = [' '.join(rng.choices(vocabulary, k=rng.randint(4, 12))) + '.' for _ in range(60)]
+    spoken = []
+    for i, sentence in enumerate(sentences):
+        if i in (10, 35):
+            spoken += rng.choices(vocabulary, k=1500)
+        if 20 <= i < 24:
+            continue
+        spoken += sentence.rstrip('.').split()
+    return sentences, [(i * 400, i * 400 + 300, word) for i, word in enumerate(spoken)]
+
+
+def merge(espeak, words, book, streaming: bool) -> tuple[str, dict]:
+    """Greedy merge of book against words, returning the csv records and the merge statistics"""
+    logfile = io.StringIO()
+    merger = audiobook.merge_srt.from_words([], espeak, logfile)
+    merger.stream = iter([[{'start': start, 'end': end, 'word': word}] for start, end, word in words])
+    if not streaming:
+        merger.fill(sys.maxsize)
+    for text, ptext in book:
+        merger.write_text(text, ptext)
+    return logfile.getvalue(), merger.stats
+
+
+def main():
+    sentences, words = synthetic_book(int(sys.argv[1]) if len(sys.argv) > 1 else 2)
+    espeak = audiobook.EspeakBackend('en-us')
+    book = list(zip(sentences, audiobook.phonemize_batch(espeak, sentences)))
+
+    whole, whole_stats = merge(espeak, words, book, False)
+    streamed, streamed_stats = merge(espeak, words, book, True)
+    for name, records, stats in (('whole', whole, whole_stats), ('streamed', streamed, streamed_stats)):
+        counts = ', '.join(f"{records.count(chr(10) + kind + '|') + records.startswith(kind + '|')} {kind}"
+                           for kind in 'GBS')
+        print(f"{name:9} {counts}, found the place again {stats['resyncs']} times")
+    if whole != streamed:
+        first = next(i for i, (a, b) in enumerate(zip(whole.splitlines(), streamed.splitlines())) if a != b)
+        print(f"DIFFERENT, from csv line {first + 1}")
+        sys.exit(1)
+    print("same")
+
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,7 @@ if [ "$1" == "" -o ! -f "$1" ];then
     echo "Usage: $0 <file with list of filenames, one per line>"
     echo "  calls audiobook-to-AI-Training-data.py <filename> repeatedly."
     echo "  Intended for use AFTER \"Parallel.sh\", to JUST do the slicing."
+    echo "  If SPOOL is set, books are queued for a worker started with --serve SPOOL instead."
     exit 1
 fi
 
@@ -25,7 +26,7 @@ while true;do
     if [ "$file" == "$oldfile" ]; then
         echo "Process finished, slicing ALL DONE!"
     fi
-    if "$PROG" "$file"; then
+    if "$PROG" "$file" ${SPOOL:+--spool "$SPOOL"}; then
         echo "Successfully processed $file"
     else
         echo "Error: audiobook-to-AI-Training-data.py exited with error $?!"